@@ -4,9 +4,93 @@ import yt_dlp
 import os
 from datetime import datetime
 import tempfile
+import unicodedata
 from pathlib import Path
 import subprocess
 import sys
+import threading
+import uuid
+import hashlib
+import sqlite3
+import re
+import time
+import tracemalloc
+import copy
+import shutil
+import zipfile
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+# Pool de trabajo compartido por todas las sesiones
+POOL_WORKERS = int(os.environ.get('MUSIC_FINDER_WORKERS', '8'))
+SESSION_CONCURRENCY_CAP = int(os.environ.get('MUSIC_FINDER_SESSION_CAP', '4'))
+SMALL_JOB_THRESHOLD = 10
+
+# Descargas en vuelo por lote cuando los enlaces se descubren sobre la marcha (listas y canales)
+MAX_IN_FLIGHT = 2 * POOL_WORKERS
+
+# Servidor de exportación de lotes en ZIP (streaming, sin cargar los archivos en memoria)
+EXPORT_HOST = os.environ.get('MUSIC_FINDER_EXPORT_HOST', '0.0.0.0')
+EXPORT_PORT = int(os.environ.get('MUSIC_FINDER_EXPORT_PORT', '8502'))
+EXPORT_BASE_URL = os.environ.get('MUSIC_FINDER_EXPORT_URL', f"http://localhost:{EXPORT_PORT}")
+EXPORT_CHUNK_SIZE = 1024 * 1024
+EXPORT_MAX_BATCHES = 100
+STORED_EXTENSIONS = {'.mp3', '.m4a', '.aac', '.opus', '.ogg', '.webm', '.mp4', '.mkv', '.jpg', '.jpeg', '.png', '.webp'}
+
+# Velocidad supuesta por descarga para la ETA previa cuando no hay límite de ancho de banda
+ASSUMED_DOWNLOAD_RATE = 2 * 1024 * 1024
+
+# Nombres de archivo: registro de publicados por carpeta y límite de longitud (bytes UTF-8).
+# El límite del sistema es 255 bytes: se deja sitio para el sufijo " [video_id]" y la extensión
+MANIFEST_NAME = ".music_finder_manifest.jsonl"
+STAGING_DIR_NAME = ".staging"
+STAGING_MAX_AGE = 24 * 3600
+MAX_FILENAME_BYTES = 200
+
+# Margen de disco libre que nunca se ocupa con descargas
+DISK_SAFETY_MARGIN = 200 * 1024 * 1024
+
+# Frecuencia máxima de refresco de las barras de progreso (veces por segundo)
+UI_REFRESH_HZ = 4
+
+# Modo perfilado: intervalo de muestreo de pilas y número de filas de cada resumen
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_TOP_N = 15
+PROFILE_DIR_NAME = "profiles"
+
+# Biblioteca local de resultados (SQLite)
+LIBRARY_DB_PATH = Path.home() / ".music_finder" / "library.db"
+LIBRARY_PAGE_SIZE = 1000
+
+# Caché de búsquedas (los "NO ENCONTRADO" caducan antes para reintentarlos de vez en cuando)
+SEARCH_CACHE_PATH = Path.home() / ".music_finder" / "search_cache.json"
+SEARCH_CACHE_TTL = 30 * 24 * 3600
+NEGATIVE_CACHE_TTL = 3 * 24 * 3600
+
+# Tiempo máximo por consulta de búsqueda y reglas para duplicar (hedging) las lentas
+SEARCH_TIMEOUT = 20
+SEARCH_SOCKET_TIMEOUT = 10
+HEDGE_MAX_RATE = 0.1
+HEDGE_MIN_SAMPLES = 20
+
+_FEAT_PATTERN = re.compile(r"\s*[\(\[](?:feat\.?|ft\.?|featuring|with)\s[^\)\]]*[\)\]]", re.IGNORECASE)
+_VERSION_PATTERN = re.compile(r"\s+-\s+[^-]*(?:remaster|version|versión|live|mono|stereo|edit|mix|demo)[^-]*$", re.IGNORECASE)
+_WORD_PATTERN = re.compile(r"\w+")
+_FILENAME_TABLE = str.maketrans({
+    **{char: None for char in '<>:"/\\|?*' + chr(127)},
+    **{chr(code): ' ' for code in range(32)},
+})
+_SPACES_PATTERN = re.compile(r"\s+")
+_RESERVED_NAMES = {'CON', 'PRN', 'AUX', 'NUL'} | {f"{prefix}{n}" for prefix in ('COM', 'LPT') for n in range(1, 10)}
+_VIDEO_ID_PATTERN = re.compile(r"(?:v=|youtu\.be/)([\w-]{11})")
+_PLAYLIST_PATTERN = re.compile(r"youtube\.com/(?:playlist\?|@|channel/|c/|user/)")
+# Hilos que ejecutan trabajos: pool compartido, búsquedas y ThreadPoolExecutor de cada descarga
+_JOB_THREAD_PATTERN = re.compile(r"music-finder-(?:\d+|search_\d+)|ThreadPoolExecutor-\d+_\d+")
 
 def check_ffmpeg():
     """Verifica si FFmpeg está instalado"""
@@ -16,28 +100,350 @@ def check_ffmpeg():
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
 
-def search_youtube_link(track_name, album_name, artist_name):
+def clean_track_name(track_name):
+    """Quita del título sufijos como '(feat. X)' o '- Remastered 2011'"""
+    track_name = _FEAT_PATTERN.sub("", track_name or "")
+    return _VERSION_PATTERN.sub("", track_name).strip()
+
+def primary_artist(artist_name):
+    """Devuelve solo el artista principal de 'Artist Name(s)'"""
+    return _FEAT_PATTERN.sub("", (artist_name or "").split(',')[0]).strip()
+
+def _words(text):
+    return set(_WORD_PATTERN.findall((text or "").casefold()))
+
+def is_confident_match(video_info, track_name, artist_name):
+    """Comprueba si un resultado de búsqueda corresponde de verdad a la canción"""
+    title_words = _words(video_info.get('title'))
+    track_words = _words(clean_track_name(track_name))
+    if not track_words or len(track_words & title_words) / len(track_words) < 0.6:
+        return False
+    artist_words = _words(primary_artist(artist_name))
+    channel_words = _words(video_info.get('channel') or video_info.get('uploader'))
+    return not artist_words or bool(artist_words & (title_words | channel_words))
+
+def build_search_queries(track_name, album_name, artist_name):
+    """Consultas en cascada: completa, artista+canción y canción limpia con artista principal"""
+    queries = []
+    for query in (
+        f"{artist_name} {track_name} {album_name}",
+        f"{artist_name} {track_name}",
+        f"{clean_track_name(track_name)} {primary_artist(artist_name)}",
+    ):
+        query = " ".join(query.split())
+        if query and query not in queries:
+            queries.append(query)
+    return queries
+
+class SearchCache:
+    """Caché persistente de búsquedas con TTL distinto para aciertos y fallos"""
+
+    def __init__(self, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL, negative_ttl=NEGATIVE_CACHE_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+        now = time.time()
+        self._entries = {key: entry for key, entry in self._entries.items() if not self._expired(entry, now)}
+
+    def _expired(self, entry, now):
+        ttl = self.negative_ttl if entry['link'] == "NO ENCONTRADO" else self.ttl
+        return now - entry['at'] > ttl
+
+    def get(self, key):
+        """Devuelve el enlace guardado o None si no existe o ha caducado"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry, time.time()):
+                return None
+            return entry['link']
+
+    def set(self, key, link):
+        """Guarda un resultado (los errores no se guardan)"""
+        if link.startswith("ERROR"):
+            return
+        with self._lock:
+            self._entries[key] = {'link': link, 'at': time.time()}
+
+    def save(self):
+        """Escribe la caché en disco de forma atómica"""
+        # Un guardado cada vez (en orden) y con un temporal propio, por si otro proceso escribe a la vez
+        with self._save_lock:
+            with self._lock:
+                data = dict(self._entries)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.path.parent,
+                                             prefix=self.path.name, suffix='.tmp', delete=False) as f:
+                json.dump(data, f, ensure_ascii=False)
+            try:
+                os.replace(f.name, self.path)
+            except OSError:
+                os.unlink(f.name)
+                raise
+
+@st.cache_resource
+def get_search_cache():
+    """Devuelve la caché de búsquedas compartida por todas las sesiones"""
+    return SearchCache()
+
+def link_status(youtube_link):
+    """Estado de búsqueda de un enlace: ENCONTRADO, NO ENCONTRADO o ERROR"""
+    if youtube_link == "NO ENCONTRADO":
+        return "NO ENCONTRADO"
+    if not youtube_link or youtube_link.startswith("ERROR"):
+        return "ERROR"
+    return "ENCONTRADO"
+
+class ResultStore:
+    """Biblioteca local de canciones resueltas y su estado de descarga.
+
+    Guarda una fila por canción (clave `track_key`) en SQLite, con índices por
+    video_id, artista y estado. `status` es ENCONTRADO, NO ENCONTRADO, ERROR,
+    DESCARGADO o ERROR DESCARGA.
+    """
+
+    def __init__(self, path=LIBRARY_DB_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS tracks (
+                    key TEXT PRIMARY KEY,
+                    track TEXT,
+                    album TEXT,
+                    artist TEXT,
+                    youtube_link TEXT,
+                    video_id TEXT,
+                    track_number INTEGER,
+                    album_image_url TEXT,
+                    status TEXT,
+                    processed_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_tracks_video_id ON tracks (video_id);
+                CREATE INDEX IF NOT EXISTS idx_tracks_artist ON tracks (artist COLLATE NOCASE);
+                CREATE INDEX IF NOT EXISTS idx_tracks_status ON tracks (status);
+            """)
+
+    def upsert_results(self, results):
+        """Guarda resultados de búsqueda (mantiene DESCARGADO si el enlace no cambia)"""
+        rows = []
+        for result in results:
+            youtube_link = result.get('youtube_link') or ''
+            match = _VIDEO_ID_PATTERN.search(youtube_link)
+            processed_at = result.get('processed_at')
+            try:
+                processed_at = datetime.fromisoformat(processed_at).timestamp() if processed_at else time.time()
+            except (TypeError, ValueError):
+                processed_at = time.time()
+            rows.append((
+                track_key(result.get('track'), result.get('artist'), result.get('album')),
+                result.get('track'), result.get('album'), result.get('artist'),
+                youtube_link, match.group(1) if match else None,
+                result.get('track_number'), result.get('album_image_url'),
+                link_status(youtube_link), processed_at,
+            ))
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO tracks (key, track, album, artist, youtube_link, video_id,
+                                    track_number, album_image_url, status, processed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    youtube_link = excluded.youtube_link,
+                    video_id = excluded.video_id,
+                    track_number = COALESCE(excluded.track_number, tracks.track_number),
+                    album_image_url = COALESCE(excluded.album_image_url, tracks.album_image_url),
+                    status = CASE WHEN tracks.status = 'DESCARGADO' AND tracks.youtube_link = excluded.youtube_link
+                                  THEN tracks.status ELSE excluded.status END,
+                    processed_at = excluded.processed_at
+            """, rows)
+
+    def set_download_status(self, statuses):
+        """Actualiza el estado de descarga a partir de pares (youtube_link, estado)"""
+        rows = []
+        for youtube_link, status in statuses:
+            match = _VIDEO_ID_PATTERN.search(youtube_link or '')
+            if match:
+                rows.append((status, match.group(1)))
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE tracks SET status = ? WHERE video_id = ?", rows)
+
+    def find(self, video_id=None, artist=None, status=None, limit=None):
+        """Busca canciones por video_id, prefijo de artista y/o estado (devuelve filas sqlite3.Row)"""
+        conditions, params = [], []
+        if video_id:
+            conditions.append("video_id = ?")
+            params.append(video_id)
+        if artist:
+            conditions.append("artist LIKE ?")
+            params.append(f"{artist}%")
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        query = "SELECT * FROM tracks"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY artist COLLATE NOCASE, track"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def find_keys(self, keys):
+        """Devuelve las filas cuyas claves `track_key` están en la lista dada"""
+        keys = list(dict.fromkeys(keys))
+        rows = []
+        with self._lock:
+            # SQLite limita el número de parámetros por consulta
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows.extend(self._conn.execute(
+                    f"SELECT * FROM tracks WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        return rows
+
+    def count_by_status(self):
+        """Número de canciones por estado"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM tracks GROUP BY status").fetchall())
+
+    def export_results(self, rows=None):
+        """Exporta filas (por defecto toda la biblioteca) con el esquema JSON de resultados"""
+        if rows is None:
+            rows = self.find()
+        return [{
+            'track': row['track'],
+            'album': row['album'],
+            'artist': row['artist'],
+            'youtube_link': row['youtube_link'],
+            'track_number': row['track_number'],
+            'album_image_url': row['album_image_url'],
+            'processed_at': datetime.fromtimestamp(row['processed_at']).isoformat(),
+        } for row in rows]
+
+@st.cache_resource
+def get_result_store():
+    """Devuelve la biblioteca local compartida por todas las sesiones"""
+    return ResultStore()
+
+class HedgedSearcher:
+    """Ejecuta búsquedas con timeout y duplica las que superan el p95 observado.
+
+    Si una llamada tarda más que el percentil 95 de las últimas latencias, se
+    lanza una copia y gana la primera respuesta. Como mucho `max_hedge_rate`
+    de las llamadas se duplican, para no multiplicar la carga.
+    """
+
+    def __init__(self, timeout=SEARCH_TIMEOUT, max_hedge_rate=HEDGE_MAX_RATE, window=200):
+        self.timeout = timeout
+        self.max_hedge_rate = max_hedge_rate
+        self._executor = ThreadPoolExecutor(max_workers=4 * POOL_WORKERS, thread_name_prefix="music-finder-search")
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._calls = 0
+        self._hedges = 0
+
+    def p95(self):
+        """Percentil 95 de las latencias recientes (None si aún hay pocas muestras)"""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def _allow_hedge(self):
+        with self._lock:
+            if self._hedges + 1 > self.max_hedge_rate * self._calls:
+                return False
+            self._hedges += 1
+            return True
+
+    def run(self, fn, *args, hedge=True):
+        """Ejecuta fn(*args) con timeout; lanza TimeoutError si no responde a tiempo"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._lock:
+            self._calls += 1
+        pending = {self._executor.submit(fn, *args)}
+
+        threshold = self.p95() if hedge else None
+        if threshold is not None and threshold < self.timeout:
+            done, _ = wait(pending, timeout=threshold)
+            if not done and self._allow_hedge():
+                pending.add(self._executor.submit(fn, *args))
+
+        last_error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    with self._lock:
+                        self._latencies.append(time.monotonic() - start)
+                    return future.result()
+                last_error = future.exception()
+        if last_error is not None and not pending:
+            raise last_error
+        raise TimeoutError(f"La búsqueda no respondió en {self.timeout} s")
+
+@st.cache_resource
+def get_hedged_searcher():
+    """Devuelve el ejecutor de búsquedas con timeout compartido por todas las sesiones"""
+    return HedgedSearcher()
+
+def ytsearch_first(query):
+    """Devuelve el primer resultado de YouTube para una consulta (o None)"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': True,
+        'socket_timeout': SEARCH_SOCKET_TIMEOUT,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        search_results = ydl.extract_info(f"ytsearch1:{query}", download=False)
+    if search_results and 'entries' in search_results and search_results['entries']:
+        return search_results['entries'][0]
+    return None
+
+def search_youtube_link(track_name, album_name, artist_name, cache=None, searcher=None, hedge=True):
     """Busca el enlace de YouTube para una canción específica"""
+    key = track_key(track_name, artist_name, album_name)
+    if cache is not None:
+        cached_link = cache.get(key)
+        if cached_link is not None:
+            return cached_link
+    
     try:
-        # Configurar yt-dlp para búsqueda
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-        }
-        
-        # Crear query de búsqueda
-        query = f"{artist_name} {track_name} {album_name}"
-        search_query = f"ytsearch1:{query}"
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            search_results = ydl.extract_info(search_query, download=False)
-            
-            if search_results and 'entries' in search_results and search_results['entries']:
-                video_info = search_results['entries'][0]
-                return f"https://www.youtube.com/watch?v={video_info['id']}"
+        # Probar las consultas en cascada hasta el primer resultado fiable
+        youtube_link = "NO ENCONTRADO"
+        for query in build_search_queries(track_name, album_name, artist_name):
+            if searcher is not None:
+                video_info = searcher.run(ytsearch_first, query, hedge=hedge)
             else:
-                return "NO ENCONTRADO"
+                video_info = ytsearch_first(query)
+            
+            if video_info:
+                link = f"https://www.youtube.com/watch?v={video_info['id']}"
+                if is_confident_match(video_info, track_name, artist_name):
+                    youtube_link = link
+                    break
+                # Sin resultado fiable se conserva el primero encontrado
+                if youtube_link == "NO ENCONTRADO":
+                    youtube_link = link
+        
+        if cache is not None:
+            cache.set(key, youtube_link)
+        return youtube_link
                 
     except Exception as e:
         return f"ERROR: {str(e)}"
@@ -51,6 +457,145 @@ def create_txt_content(results):
         txt_content += "-" * 50 + "\n"
     return txt_content
 
+def write_zip_stream(fileobj, files):
+    """Escribe un ZIP archivo a archivo y por bloques en un stream no posicionable.
+
+    El audio y el vídeo ya están comprimidos, así que se guardan sin compresión
+    (ZIP_STORED); el resto (JSON, TXT) se comprime con deflate.
+    """
+    with zipfile.ZipFile(fileobj, 'w', allowZip64=True) as zf:
+        for path, arcname in files:
+            if not os.path.isfile(path):
+                continue
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+                zinfo.compress_type = zipfile.ZIP_STORED
+            else:
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, zf.open(zinfo, 'w', force_zip64=True) as dst:
+                shutil.copyfileobj(src, dst, EXPORT_CHUNK_SIZE)
+
+class _ExportRequestHandler(BaseHTTPRequestHandler):
+    """Sirve /export/<token> como un ZIP generado al vuelo"""
+
+    def do_GET(self):
+        token = self.path.rstrip('/').rsplit('/', 1)[-1]
+        export = self.server.exports.get(token)
+        if export is None:
+            self.send_error(404, "Exportación no encontrada")
+            return
+        name, files = export
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Disposition', f'attachment; filename="{name}.zip"')
+        self.end_headers()
+        try:
+            write_zip_stream(self.wfile, files)
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente canceló la descarga
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+class ExportServer:
+    """Servidor HTTP en segundo plano que entrega lotes terminados como ZIP en streaming"""
+
+    def __init__(self, host=EXPORT_HOST, port=EXPORT_PORT, base_url=EXPORT_BASE_URL):
+        self.base_url = base_url.rstrip('/')
+        self._httpd = ThreadingHTTPServer((host, port), _ExportRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.exports = self._exports = OrderedDict()
+        self._cleanup_dirs = {}
+        threading.Thread(target=self._httpd.serve_forever, name="music-finder-export", daemon=True).start()
+
+    def register(self, name, files, cleanup_dir=None):
+        """Registra los archivos de un lote y devuelve la URL de descarga del ZIP.
+
+        `cleanup_dir` (p. ej. la carpeta temporal del informe) se borra cuando
+        el lote sale del registro.
+        """
+        token = uuid.uuid4().hex
+        self._exports[token] = (name, list(files))
+        if cleanup_dir is not None:
+            self._cleanup_dirs[token] = cleanup_dir
+        while len(self._exports) > EXPORT_MAX_BATCHES:
+            evicted, _ = self._exports.popitem(last=False)
+            evicted_dir = self._cleanup_dirs.pop(evicted, None)
+            if evicted_dir is not None:
+                shutil.rmtree(evicted_dir, ignore_errors=True)
+        return f"{self.base_url}/export/{token}"
+
+@st.cache_resource
+def get_export_server():
+    """Devuelve el servidor de exportación del proceso (lanza OSError si el puerto no está disponible)"""
+    # Un fallo no se guarda en caché: la siguiente exportación lo vuelve a intentar
+    return ExportServer()
+
+def offer_batch_export(batch_name, output_files, results, txt_content=None):
+    """Guarda el informe del lote y muestra el enlace para descargar todo en un ZIP"""
+    report_dir = tempfile.mkdtemp()
+    report_files = []
+    json_filepath = os.path.join(report_dir, f"{batch_name}.json")
+    with open(json_filepath, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    report_files.append((json_filepath, os.path.basename(json_filepath)))
+    if txt_content is not None:
+        txt_filepath = os.path.join(report_dir, f"{batch_name}.txt")
+        with open(txt_filepath, 'w', encoding='utf-8') as f:
+            f.write(txt_content)
+        report_files.append((txt_filepath, os.path.basename(txt_filepath)))
+    
+    try:
+        export_server = get_export_server()
+    except OSError as e:
+        shutil.rmtree(report_dir, ignore_errors=True)
+        st.warning(f"⚠️ No se pudo iniciar el servidor de exportación en el puerto {EXPORT_PORT}: {str(e)}")
+        return
+    files = [(path, os.path.basename(path)) for path in output_files] + report_files
+    export_url = export_server.register(batch_name, files, cleanup_dir=report_dir)
+    st.markdown(f"📦 [Descargar lote completo en ZIP]({export_url})")
+
+def track_key(track_name, artist_name, album_name):
+    """Clave hash normalizada de una canción (ignora mayúsculas y espacios extra)"""
+    raw = "\x1f".join(" ".join(str(value or '').casefold().split()) for value in (track_name, artist_name, album_name))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def _needs_search(result):
+    """True si un resultado anterior hay que volver a buscarlo (ERROR o NO ENCONTRADO)"""
+    youtube_link = str(result.get('youtube_link', ''))
+    return youtube_link == "NO ENCONTRADO" or youtube_link.startswith("ERROR")
+
+def diff_playlist(new_export, previous_results):
+    """Compara una exportación nueva de Exportify con resultados anteriores.
+
+    Devuelve (added, removed, unchanged): filas de la exportación que hay que
+    buscar, resultados anteriores que ya no están en la playlist y resultados
+    anteriores que se conservan. Los resultados con ERROR o NO ENCONTRADO se
+    vuelven a buscar (la caché de búsquedas responde a los NO ENCONTRADO
+    recientes sin consultar YouTube hasta que caduca NEGATIVE_CACHE_TTL).
+    """
+    previous_index = {}
+    for result in previous_results:
+        key = track_key(result.get('track'), result.get('artist'), result.get('album'))
+        previous_index.setdefault(key, result)
+
+    added = []
+    seen = set()
+    for song in new_export:
+        key = track_key(song.get('Track Name'), song.get('Artist Name(s)'), song.get('Album Name'))
+        if key in seen:
+            continue
+        seen.add(key)
+        previous = previous_index.get(key)
+        if previous is None or _needs_search(previous):
+            added.append(song)
+
+    removed = [result for key, result in previous_index.items() if key not in seen]
+    unchanged = [result for key, result in previous_index.items()
+                 if key in seen and not _needs_search(result)]
+    return added, removed, unchanged
+
 def download_mp3(youtube_url, output_path, track_name, artist_name):
     """Descarga un video de YouTube como MP3"""
     try:
@@ -74,6 +619,941 @@ def download_mp3(youtube_url, output_path, track_name, artist_name):
     except Exception as e:
         return f"ERROR: {str(e)}"
 
+def normalize_youtube_link(link):
+    """Normaliza un enlace de vídeo, lista o canal de YouTube; devuelve None si no es válido"""
+    link = link.strip()
+    if 'youtu.be/' in link:
+        video_id = link.split('youtu.be/')[-1].split('?')[0]
+        return f"https://www.youtube.com/watch?v={video_id}"
+    if 'youtube.com/watch?v=' in link or _PLAYLIST_PATTERN.search(link):
+        return link
+    return None
+
+def is_playlist_link(link):
+    """Indica si el enlace es una lista de reproducción o un canal"""
+    return 'watch?v=' not in link and bool(_PLAYLIST_PATTERN.search(link))
+
+def iter_playlist_video_urls(playlist_url):
+    """Recorre una lista o canal página a página sin cargar el listado completo.
+
+    Con `process=False` yt-dlp no procesa el resultado: `entries` es el
+    generador del extractor, que pide la siguiente página solo cuando se
+    consume la anterior.
+    """
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(playlist_url, download=False, process=False)
+        # Sin procesar, las redirecciones (p. ej. canal -> lista de subidas) llegan sin resolver
+        if info.get('_type') in ('url', 'url_transparent'):
+            yield from iter_playlist_video_urls(info['url'])
+            return
+        for entry in info.get('entries') or []:
+            if not entry:
+                continue
+            # Los canales devuelven sus pestañas (Videos, Shorts...) como sublistas
+            if entry.get('_type') == 'playlist' or entry.get('ie_key') == 'YoutubeTab':
+                yield from iter_playlist_video_urls(entry.get('url') or entry.get('webpage_url'))
+            elif entry.get('id'):
+                yield f"https://www.youtube.com/watch?v={entry['id']}"
+
+def iter_video_urls(links, on_error=None):
+    """Expande listas y canales de forma perezosa y deja pasar los enlaces de vídeo"""
+    for link in links:
+        if not is_playlist_link(link):
+            yield link
+            continue
+        try:
+            yield from iter_playlist_video_urls(link)
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(link, e)
+
+class TokenBucket:
+    """Límite global de ancho de banda (bytes/s) compartido por todas las descargas.
+
+    Cada hilo descuenta los bytes recibidos; si el cubo queda en negativo,
+    el hilo duerme lo necesario para pagar la deuda, así que la suma de todas
+    las descargas no supera `rate`. Con rate 0 no hay límite.
+    """
+
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """Cambia el límite (bytes/s); 0 desactiva el límite"""
+        with self._lock:
+            self.rate = max(0, rate)
+            self._tokens = self.rate
+            self._last = time.monotonic()
+
+    def consume(self, amount):
+        """Descuenta `amount` bytes y espera si se ha superado el límite"""
+        with self._lock:
+            if self.rate <= 0:
+                return
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate) - amount
+            self._last = now
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+    def hook(self):
+        """Crea un progress_hook de yt-dlp que aplica el límite a una descarga"""
+        lock = threading.Lock()
+        seen = {}
+        def throttle_hook(d):
+            if d.get('status') != 'downloading':
+                return
+            downloaded = d.get('downloaded_bytes') or 0
+            with lock:
+                delta = downloaded - seen.get(d.get('filename'), 0)
+                seen[d.get('filename')] = downloaded
+            if delta > 0:
+                self.consume(delta)
+        return throttle_hook
+
+class DiskBudgetExceeded(Exception):
+    """La descarga no cabe en el presupuesto de disco configurado"""
+
+class DiskBudget:
+    """Presupuesto global de escritura en disco.
+
+    Antes de descargar, cada elemento reserva su tamaño estimado; solo se admite
+    si cabe en el espacio libre (menos DISK_SAFETY_MARGIN) y en el presupuesto
+    configurado. Con budget 0 solo se comprueba el espacio libre.
+    """
+
+    def __init__(self, budget=0):
+        self._lock = threading.Lock()
+        self._reserved = 0
+        self.set_budget(budget)
+
+    def set_budget(self, budget):
+        """Cambia el presupuesto (bytes) y reinicia el contador de uso"""
+        with self._lock:
+            self.budget = max(0, budget)
+            self.used = 0
+
+    @contextmanager
+    def reserve(self, path, estimate, scratch=0):
+        """Reserva `estimate` bytes en `path` durante la descarga o lanza DiskBudgetExceeded.
+
+        `scratch` son bytes temporales (p. ej. el original antes de convertirlo)
+        que se reservan mientras dura la descarga pero no cuentan como uso al terminar.
+        """
+        reserved = estimate + scratch
+        with self._lock:
+            free = shutil.disk_usage(path).free
+            if self._reserved + reserved > free - DISK_SAFETY_MARGIN:
+                raise DiskBudgetExceeded(f"Espacio en disco insuficiente ({format_bytes(free)} libres)")
+            if self.budget and self.used + self._reserved + reserved > self.budget:
+                raise DiskBudgetExceeded(f"Presupuesto de disco agotado ({format_bytes(self.budget)})")
+            self._reserved += reserved
+        completed = False
+        try:
+            yield
+            completed = True
+        finally:
+            with self._lock:
+                self._reserved -= reserved
+                if completed:
+                    self.used += estimate
+
+@st.cache_resource
+def get_bandwidth_limiter():
+    """Devuelve el límite de ancho de banda compartido por todas las sesiones"""
+    return TokenBucket()
+
+@st.cache_resource
+def get_disk_budget():
+    """Devuelve el presupuesto de disco compartido por todas las sesiones"""
+    return DiskBudget()
+
+def estimate_download_size(info):
+    """Tamaño estimado de los formatos elegidos (filesize, filesize_approx o bitrate × duración)"""
+    total = 0
+    for fmt in info.get('requested_formats') or [info]:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if not size and fmt.get('tbr') and info.get('duration'):
+            size = fmt['tbr'] * 1000 / 8 * info['duration']
+        total += int(size or 0)
+    return total
+
+@contextmanager
+def reserve_disk(disk_budget, path, estimate, scratch=0):
+    """Reserva espacio en el presupuesto de disco si se ha indicado uno"""
+    if disk_budget is None:
+        yield
+    else:
+        with disk_budget.reserve(path, estimate, scratch):
+            yield
+
+def classify_unavailable(error_message):
+    """Traduce el error de yt-dlp a un motivo de no disponibilidad legible (None si no es definitivo)"""
+    message = error_message.lower()
+    if 'private' in message:
+        return "Privado"
+    if 'country' in message or 'geo' in message:
+        return "Bloqueado por región"
+    if 'age' in message and ('sign in' in message or 'confirm' in message):
+        return "Restricción de edad"
+    if 'unavailable' in message or 'removed' in message or 'terminated' in message:
+        return "Eliminado o no disponible"
+    return None
+
+def preflight_video(youtube_url, ydl_format):
+    """Comprueba si un vídeo está disponible y estima tamaño y duración sin descargarlo"""
+    ydl_opts = {
+        'format': ydl_format,
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(youtube_url, download=False)
+        return {'available': True, 'size': estimate_download_size(info), 'duration': info.get('duration') or 0}
+    except Exception as e:
+        reason = classify_unavailable(str(e))
+        if reason is None:
+            # Errores de red u otros fallos pasajeros: la canción se intenta descargar igualmente
+            return {'available': True, 'size': 0, 'duration': 0, 'error': str(e)}
+        return {'available': False, 'reason': reason}
+
+def sanitize_filename(name, fallback="Unknown"):
+    """Limpia un nombre de archivo para Windows/macOS/Linux conservando letras Unicode"""
+    name = unicodedata.normalize('NFC', str(name or '')).translate(_FILENAME_TABLE)
+    name = _SPACES_PATTERN.sub(' ', name).strip().rstrip('. ')
+    name = name.encode('utf-8')[:MAX_FILENAME_BYTES].decode('utf-8', 'ignore').rstrip('. ')
+    if not name:
+        name = fallback
+    if name.split('.')[0].upper() in _RESERVED_NAMES:
+        name = f"_{name}"
+    return name
+
+class OutputManifest:
+    """Registro de los archivos publicados en una carpeta de destino.
+
+    Las descargas se hacen en `.staging/` (mismo sistema de archivos) y solo se
+    publican con un rename atómico cuando están completas, así que un archivo
+    con nombre final siempre está terminado. El manifiesto (JSON Lines, una
+    línea por publicación) dice qué vídeo ocupa cada nombre: si otra canción
+    ya lo usa, el nuevo archivo recibe el sufijo determinista ` [video_id]`.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._owners = {}
+        self._by_video = {}
+        self._sweep_staging()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._add_entry(entry['file'], entry['video_id'])
+        except OSError:
+            pass
+
+    def _sweep_staging(self):
+        # Carpetas temporales que dejaron ejecuciones interrumpidas
+        staging_root = os.path.join(self.directory, STAGING_DIR_NAME)
+        cutoff = time.time() - STAGING_MAX_AGE
+        try:
+            entries = list(os.scandir(staging_root))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def _add_entry(self, filename, video_id):
+        self._owners[filename] = video_id
+        self._by_video.setdefault(video_id, set()).add(filename)
+
+    def completed(self, base_name, video_id):
+        """Rutas ya publicadas para este vídeo con este nombre base (lista vacía si no hay)"""
+        with self._lock:
+            filenames = self._by_video.get(video_id, ())
+            return [
+                os.path.join(self.directory, filename) for filename in sorted(filenames)
+                if filename.startswith((f"{base_name}.", f"{base_name} [{video_id}]."))
+                and os.path.exists(os.path.join(self.directory, filename))
+            ]
+
+    @contextmanager
+    def staging(self):
+        """Carpeta temporal en el mismo sistema de archivos, borrada al terminar"""
+        staging_root = os.path.join(self.directory, STAGING_DIR_NAME)
+        os.makedirs(staging_root, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(dir=staging_root)
+        try:
+            yield staging_dir
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _is_taken(self, filename, video_id):
+        owner = self._owners.get(filename)
+        return owner != video_id and (owner is not None or os.path.exists(os.path.join(self.directory, filename)))
+
+    def publish(self, staged_paths, base_name, video_id):
+        """Mueve los archivos terminados de un vídeo a sus nombres finales de forma atómica y los registra.
+
+        Todos (el archivo principal y sus subtítulos o miniatura) comparten el
+        mismo nombre final; la extensión es todo lo que sigue al primer punto
+        del nombre en `.staging/` (`sidecar.es.vtt` -> `.es.vtt`).
+        """
+        suffixes = [os.path.basename(path)[os.path.basename(path).index('.'):] for path in staged_paths]
+        final_paths = []
+        with self._lock:
+            stem = base_name
+            if any(self._is_taken(f"{base_name}{suffix}", video_id) for suffix in suffixes):
+                stem = f"{base_name} [{video_id}]"
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for staged_path, suffix in zip(staged_paths, suffixes):
+                    filename = f"{stem}{suffix}"
+                    final_path = os.path.join(self.directory, filename)
+                    os.replace(staged_path, final_path)
+                    self._add_entry(filename, video_id)
+                    f.write(json.dumps({'file': filename, 'video_id': video_id,
+                                        'completed_at': datetime.now().isoformat()}, ensure_ascii=False) + "\n")
+                    final_paths.append(final_path)
+        return final_paths
+
+@st.cache_resource
+def _cached_output_manifest(directory):
+    return OutputManifest(directory)
+
+def get_output_manifest(directory):
+    """Devuelve el manifiesto de una carpeta de destino, compartido por todos los workers"""
+    # Una sola instancia por carpeta real, escriba el usuario la ruta como la escriba
+    return _cached_output_manifest(os.path.realpath(os.path.expanduser(directory)))
+
+def _staged_sidecars(staging_dir):
+    """Subtítulos y miniaturas descargados en `.staging/` (plantilla `sidecar.%(ext)s`)"""
+    return sorted(os.path.join(staging_dir, name) for name in os.listdir(staging_dir) if name.startswith('sidecar.'))
+
+def _staging_outtmpl(staging_dir, name):
+    """Plantillas de yt-dlp que dejan el archivo y sus subtítulos/miniatura en `.staging/`"""
+    sidecar_template = os.path.join(staging_dir, 'sidecar.%(ext)s')
+    return {
+        'default': os.path.join(staging_dir, f'{name}.%(ext)s'),
+        'subtitle': sidecar_template,
+        'thumbnail': sidecar_template,
+    }
+
+def run_download(youtube_url, ydl_opts, manifest, name=None, name_prefix='', disk_budget=None):
+    """Descarga un enlace en `.staging/`, lo publica en la carpeta del manifiesto y devuelve las rutas finales.
+
+    El nombre final es `name` o, si no se indica, `name_prefix` + el título del vídeo.
+    """
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(youtube_url, download=False)
+    base_name = name or sanitize_filename(f"{name_prefix}{info.get('title') or 'Unknown'}")
+    existing = manifest.completed(base_name, info['id'])
+    if existing:
+        return existing
+
+    # La conversión con FFmpeg necesita espacio temporal para el original además del resultado
+    estimate = estimate_download_size(info)
+    scratch = estimate if ydl_opts.get('postprocessors') else 0
+    with reserve_disk(disk_budget, manifest.directory, estimate, scratch), manifest.staging() as staging_dir:
+        staged_opts = dict(ydl_opts, outtmpl=_staging_outtmpl(staging_dir, 'download'))
+        with yt_dlp.YoutubeDL(staged_opts) as ydl:
+            info = ydl.process_ie_result(info, download=True)
+        downloaded = [d['filepath'] for d in (info or {}).get('requested_downloads', []) if d.get('filepath')]
+        if not downloaded:
+            raise RuntimeError("yt-dlp no descargó ningún archivo")
+        return manifest.publish(downloaded + _staged_sidecars(staging_dir), base_name, info['id'])
+
+def build_audio_opts(quality, use_mp3):
+    """Crea las opciones de yt-dlp para audio (MP3 con FFmpeg o audio original)"""
+    if use_mp3:
+        return {
+            'format': 'bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': quality,
+            }],
+            'noplaylist': True,
+            'quiet': True,
+            'no_warnings': True,
+        }
+    return {
+        'format': 'bestaudio[ext=m4a]/bestaudio/best' if quality == 'best' else 'worstaudio',
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+    }
+
+def run_ffmpeg(cmd):
+    """Ejecuta FFmpeg y, si falla, lanza un error con su salida de error"""
+    try:
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    except subprocess.CalledProcessError as e:
+        details = e.stderr.decode('utf-8', 'replace').strip() if e.stderr else ''
+        raise RuntimeError(f"FFmpeg terminó con código {e.returncode}: {details}") from e
+
+def merge_container(video_ext, audio_ext):
+    """Elige un contenedor que admita copiar ambos streams sin recodificar"""
+    if video_ext == 'mp4' and audio_ext in ('m4a', 'mp4'):
+        return 'mp4'
+    if video_ext == 'webm' and audio_ext == 'webm':
+        return 'webm'
+    return 'mkv'
+
+def _download_stream(info, ydl_opts):
+    """Descarga un único formato reutilizando la información ya extraída"""
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+    return result['requested_downloads'][0]['filepath']
+
+def download_merged_video(video_url, ydl_opts, manifest, disk_budget=None):
+    """Descarga vídeo y audio en paralelo y los une en una sola pasada sin recodificar.
+
+    Los streams se guardan en `.staging/` y FFmpeg los combina con `-c copy`
+    directamente en el contenedor final, que se publica con un rename atómico.
+    """
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(video_url, download=False)
+    base_name = sanitize_filename(info.get('title'))
+    existing = manifest.completed(base_name, info['id'])
+    if existing:
+        return existing
+
+    estimate = estimate_download_size(info)
+    requested = info.get('requested_formats') or []
+    video_fmt = next((fmt for fmt in requested if fmt.get('vcodec') != 'none'), None)
+    audio_fmt = next((fmt for fmt in requested if fmt.get('vcodec') == 'none'), None)
+    info.pop('requested_formats', None)
+
+    # El selector eligió un único formato: no hay nada que combinar
+    if video_fmt is None or audio_fmt is None:
+        with reserve_disk(disk_budget, manifest.directory, estimate), manifest.staging() as staging_dir:
+            single_opts = dict(ydl_opts, outtmpl=_staging_outtmpl(staging_dir, 'video'))
+            video_path = _download_stream(info, single_opts)
+            return manifest.publish([video_path] + _staged_sidecars(staging_dir), base_name, info['id'])
+
+    # Los streams y el archivo combinado coexisten hasta el final (los streams se borran después)
+    with reserve_disk(disk_budget, manifest.directory, estimate, estimate), manifest.staging() as staging_dir:
+        # Subtítulos y miniatura se descargan junto al vídeo y se publican con el archivo combinado
+        video_opts = dict(ydl_opts, format=video_fmt['format_id'], outtmpl=_staging_outtmpl(staging_dir, 'video'))
+        audio_opts = dict(ydl_opts, format=audio_fmt['format_id'],
+                          outtmpl=os.path.join(staging_dir, 'audio.%(ext)s'),
+                          writesubtitles=False, writeautomaticsub=False, writethumbnail=False)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            video_future = executor.submit(_download_stream, info, video_opts)
+            audio_future = executor.submit(_download_stream, info, audio_opts)
+            video_path = video_future.result()
+            audio_path = audio_future.result()
+
+        container = merge_container(video_fmt.get('ext'), audio_fmt.get('ext'))
+        merged_path = os.path.join(staging_dir, f"merged.{container}")
+        run_ffmpeg(['ffmpeg', '-y', '-loglevel', 'error', '-i', video_path, '-i', audio_path,
+                    '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', merged_path])
+        return manifest.publish([merged_path] + _staged_sidecars(staging_dir), base_name, info['id'])
+
+def fetch_cover(url, dest_dir):
+    """Descarga la imagen de portada; devuelve la ruta o None si falla"""
+    try:
+        cover_path = os.path.join(dest_dir, 'cover')
+        with urllib.request.urlopen(url, timeout=30) as response, open(cover_path, 'wb') as f:
+            shutil.copyfileobj(response, f)
+        return cover_path
+    except Exception:
+        return None
+
+def download_tagged_mp3(youtube_url, ydl_opts, manifest, name, quality, tags, cover_url=None, disk_budget=None):
+    """Descarga el audio y lo convierte a MP3 con etiquetas ID3 y portada en una sola pasada.
+
+    La portada (la del álbum de Spotify o, si no hay, la miniatura del vídeo)
+    se descarga en paralelo con el audio y FFmpeg la incrusta durante la misma
+    conversión, sin reescribir el archivo después.
+    """
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(youtube_url, download=False)
+    existing = manifest.completed(name, info['id'])
+    if existing:
+        return existing
+
+    # El audio original y el MP3 coexisten hasta el final (el original se borra después)
+    estimate = estimate_download_size(info)
+    with reserve_disk(disk_budget, manifest.directory, estimate, estimate), manifest.staging() as staging_dir:
+        audio_opts = dict(ydl_opts, outtmpl=os.path.join(staging_dir, 'audio.%(ext)s'))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            cover_future = None
+            if cover_url or info.get('thumbnail'):
+                cover_future = executor.submit(fetch_cover, cover_url or info['thumbnail'], staging_dir)
+            audio_future = executor.submit(_download_stream, info, audio_opts)
+            audio_path = audio_future.result()
+            cover_path = cover_future.result() if cover_future else None
+
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-i', audio_path]
+        if cover_path:
+            cmd += ['-i', cover_path]
+        cmd += ['-map', '0:a:0']
+        if cover_path:
+            cmd += ['-map', '1:v:0', '-c:v', 'mjpeg', '-disposition:v:0', 'attached_pic',
+                    '-metadata:s:v', 'title=Album cover', '-metadata:s:v', 'comment=Cover (front)']
+        cmd += ['-c:a', 'libmp3lame', '-b:a', f'{quality}k', '-id3v2_version', '3']
+        for key, value in tags.items():
+            if value not in (None, ''):
+                cmd += ['-metadata', f'{key}={value}']
+        staged_path = os.path.join(staging_dir, 'tagged.mp3')
+        cmd.append(staged_path)
+        run_ffmpeg(cmd)
+        return manifest.publish([staged_path], name, info['id'])
+
+class FairWorkerPool:
+    """Pool de hilos único para todo el proceso, repartido de forma justa entre sesiones.
+
+    Cada sesión tiene dos colas: 'interactive' para trabajos pequeños, que se
+    atienden primero, y 'bulk' para lotes grandes, que se reparten con deficit
+    round-robin según el peso de cada sesión. Ninguna sesión puede ocupar más de
+    `session_cap` hilos a la vez.
+    """
+
+    def __init__(self, max_workers=POOL_WORKERS, session_cap=SESSION_CONCURRENCY_CAP, quantum=1.0):
+        self.session_cap = max(1, session_cap)
+        self.quantum = quantum
+        self._cond = threading.Condition()
+        self._sessions = OrderedDict()
+        for n in range(max(1, max_workers)):
+            threading.Thread(target=self._worker, name=f"music-finder-{n}", daemon=True).start()
+
+    def submit(self, session_id, fn, *args, interactive=False, weight=1.0, **kwargs):
+        """Encola una tarea de la sesión y devuelve su Future"""
+        future = Future()
+        with self._cond:
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = {'interactive': deque(), 'bulk': deque(), 'running': 0, 'deficit': 0.0, 'weight': weight}
+                self._sessions[session_id] = state
+            state['weight'] = max(weight, 0.01)
+            lane = 'interactive' if interactive else 'bulk'
+            state[lane].append((future, fn, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def _next_task(self):
+        # Los trabajos pequeños pasan delante de los lotes grandes
+        for session_id, state in self._sessions.items():
+            if state['interactive'] and state['running'] < self.session_cap:
+                self._sessions.move_to_end(session_id)
+                return state, state['interactive'].popleft()
+
+        # Deficit round-robin entre las colas masivas (coste 1 por tarea)
+        while True:
+            eligible = [sid for sid, s in self._sessions.items() if s['bulk'] and s['running'] < self.session_cap]
+            if not eligible:
+                return None, None
+            for session_id in eligible:
+                state = self._sessions[session_id]
+                if state['deficit'] < 1:
+                    state['deficit'] += self.quantum * state['weight']
+                if state['deficit'] >= 1:
+                    state['deficit'] -= 1
+                    if state['deficit'] < 1:
+                        self._sessions.move_to_end(session_id)
+                    return state, state['bulk'].popleft()
+                self._sessions.move_to_end(session_id)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                state, task = self._next_task()
+                while task is None:
+                    self._cond.wait()
+                    state, task = self._next_task()
+                state['running'] += 1
+
+            future, fn, args, kwargs = task
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        # Incluye SystemExit/KeyboardInterrupt: el hilo sigue sirviendo tareas
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    state['running'] -= 1
+                    for session_id in [sid for sid, s in self._sessions.items()
+                                       if not s['running'] and not s['interactive'] and not s['bulk']]:
+                        del self._sessions[session_id]
+                    if not state['bulk']:
+                        state['deficit'] = 0.0
+                    self._cond.notify_all()
+
+@st.cache_resource
+def get_worker_pool():
+    """Devuelve el pool de trabajo compartido por todas las sesiones del proceso"""
+    return FairWorkerPool()
+
+def get_session_id():
+    """Identificador estable de la sesión actual de Streamlit"""
+    if 'session_id' not in st.session_state:
+        st.session_state['session_id'] = uuid.uuid4().hex
+    return st.session_state['session_id']
+
+def submit_batch(fn, arg_list):
+    """Envía un lote al pool compartido; los lotes pequeños se marcan como interactivos"""
+    pool = get_worker_pool()
+    session_id = get_session_id()
+    interactive = len(arg_list) <= SMALL_JOB_THRESHOLD
+    return [pool.submit(session_id, fn, *args, interactive=interactive) for args in arg_list]
+
+def submit_task(fn, *args, interactive=False):
+    """Envía una tarea suelta de la sesión actual al pool compartido"""
+    return get_worker_pool().submit(get_session_id(), fn, *args, interactive=interactive)
+
+def cancel_pending(futures):
+    """Cancela las tareas que aún no han empezado (p. ej. si Streamlit reinicia el script)"""
+    for future in futures:
+        future.cancel()
+
+def format_bytes(num_bytes):
+    """Formatea una cantidad de bytes de forma legible"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num_bytes < 1024 or unit == 'GB':
+            return f"{num_bytes:.1f} {unit}" if unit != 'B' else f"{int(num_bytes)} B"
+        num_bytes /= 1024
+
+def format_eta(seconds):
+    """Formatea segundos restantes como h:mm:ss o m:ss"""
+    if seconds is None:
+        return "--:--"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+class BatchProgress:
+    """Progreso agregado de un lote a partir de los progress_hooks de todos los workers.
+
+    Los hooks se llaman desde los hilos del pool; la interfaz solo lee
+    `snapshot()` desde el hilo de Streamlit.
+    """
+
+    def __init__(self, total_items):
+        self.total_items = total_items
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._completed = 0
+        self._bytes = 0
+        self._finished_bytes = 0
+        self._finished_sized = 0
+        self._started = time.monotonic()
+        self._rate = 0.0
+        self._last_sample = (self._started, 0)
+
+    def hook(self, task_id):
+        """Crea un progress_hook de yt-dlp asociado a una tarea del lote"""
+        def progress_hook(d):
+            downloaded = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            if d.get('status') == 'finished':
+                downloaded = total = downloaded or total
+            with self._lock:
+                streams = self._streams.setdefault(task_id, {})
+                previous = streams.get(d.get('filename'), (0, 0))
+                self._bytes += max(0, downloaded - previous[0])
+                streams[d.get('filename')] = (downloaded, max(total, downloaded))
+        return progress_hook
+
+    def item_done(self, task_id):
+        """Marca una tarea como terminada (con éxito o no)"""
+        with self._lock:
+            self._completed += 1
+            streams = self._streams.pop(task_id, None)
+            # El tamaño real de las tareas terminadas sirve para estimar las pendientes
+            if streams:
+                self._finished_bytes += sum(done for done, _ in streams.values())
+                self._finished_sized += 1
+
+    def add_items(self, count):
+        """Amplía el total cuando los elementos se descubren sobre la marcha"""
+        with self._lock:
+            self.total_items += count
+
+    def snapshot(self):
+        """Devuelve fracción completada, bytes descargados y esperados, velocidad (B/s) y ETA (s).
+
+        Los bytes esperados suman total_bytes/total_bytes_estimate de las
+        descargas en curso, el tamaño real de las terminadas y, para las que aún
+        no han empezado, el tamaño medio observado. La ETA es lo que falta entre
+        la velocidad medida; sin tamaños conocidos se estima por número de elementos.
+        """
+        with self._lock:
+            partial_items = 0.0
+            remaining_bytes = 0
+            known_bytes = self._finished_bytes
+            sized_items = self._finished_sized
+            for streams in self._streams.values():
+                downloaded = sum(done for done, _ in streams.values())
+                total = sum(size for _, size in streams.values())
+                if total:
+                    partial_items += min(1.0, downloaded / total)
+                    remaining_bytes += max(0, total - downloaded)
+                    known_bytes += total
+                    sized_items += 1
+            completed = self._completed
+            downloaded_bytes = self._bytes
+            not_started = max(0, self.total_items - completed - len(self._streams))
+            if sized_items:
+                remaining_bytes += not_started * known_bytes / sized_items
+
+            now = time.monotonic()
+            sample_time, sample_bytes = self._last_sample
+            if now - sample_time >= 0.5:
+                current_rate = (downloaded_bytes - sample_bytes) / (now - sample_time)
+                self._rate = current_rate if not self._rate else 0.3 * current_rate + 0.7 * self._rate
+                self._last_sample = (now, downloaded_bytes)
+            rate = self._rate
+
+        fraction = min(1.0, (completed + partial_items) / self.total_items) if self.total_items else 0.0
+        expected_bytes = downloaded_bytes + int(remaining_bytes) if sized_items else 0
+        if sized_items and rate > 0:
+            eta = remaining_bytes / rate
+        else:
+            elapsed = now - self._started
+            eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+        return {'fraction': fraction, 'completed': completed, 'bytes': downloaded_bytes,
+                'total_bytes': expected_bytes, 'rate': rate, 'eta': eta}
+
+class ThrottledProgressUI:
+    """Refresca una barra de progreso y su texto como máximo `max_hz` veces por segundo"""
+
+    def __init__(self, progress_bar, status_text, progress, max_hz=UI_REFRESH_HZ):
+        self.progress_bar = progress_bar
+        self.status_text = status_text
+        self.progress = progress
+        self.min_interval = 1.0 / max_hz
+        self.message = ""
+        self._last_refresh = 0.0
+
+    def refresh(self, message=None, force=False):
+        """Actualiza la interfaz si ha pasado el intervalo mínimo (o si se fuerza)"""
+        if message is not None:
+            self.message = message
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.min_interval:
+            return
+        self._last_refresh = now
+        snap = self.progress.snapshot()
+        self.progress_bar.progress(snap['fraction'])
+        transferred = format_bytes(snap['bytes'])
+        if snap['total_bytes']:
+            transferred += f" de {format_bytes(snap['total_bytes'])}"
+        self.status_text.text(
+            f"{self.message} | {snap['completed']}/{self.progress.total_items} | "
+            f"{transferred} | {format_bytes(snap['rate'])}/s | ETA {format_eta(snap['eta'])}"
+        )
+
+def iter_completed(futures, on_tick=None, interval=1.0 / UI_REFRESH_HZ):
+    """Como as_completed, pero llamando a `on_tick` periódicamente mientras se espera"""
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=interval, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future
+        if on_tick is not None:
+            on_tick()
+
+def iter_streamed(items, submit, max_in_flight=MAX_IN_FLIGHT, on_tick=None, interval=1.0 / UI_REFRESH_HZ):
+    """Envía elementos de un iterador al pool según se liberan huecos.
+
+    Devuelve pares (índice, elemento, future) a medida que terminan, sin
+    materializar el iterador completo.
+    """
+    items = enumerate(items)
+    pending = {}
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    index, item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[submit(index, item)] = (index, item)
+            if not pending:
+                return
+            done, _ = wait(pending, timeout=interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, item = pending.pop(future)
+                yield index, item, future
+            if on_tick is not None:
+                on_tick()
+    finally:
+        cancel_pending(pending)
+
+def _frame_label(code):
+    """Nombre legible de una función para los perfiles"""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _signed_bytes(num_bytes):
+    """Formatea una variación de memoria con signo"""
+    return ('-' if num_bytes < 0 else '+') + format_bytes(abs(num_bytes))
+
+class JobProfiler:
+    """Perfil opcional de CPU y memoria de un trabajo, guardado junto a sus resultados.
+
+    Un hilo muestrea cada PROFILE_SAMPLE_INTERVAL segundos las pilas del hilo
+    de Streamlit que lanzó el trabajo, de los workers del pool y de los hilos
+    auxiliares de las descargas (los que esperan trabajo se ignoran), sin
+    instrumentar cada llamada. tracemalloc compara la memoria al empezar y al
+    terminar. Al salir se escriben en `<output_dir>/profiles/` las pilas en
+    formato "folded" (flamegraph.pl, speedscope), la instantánea de
+    tracemalloc y un resumen con las funciones más calientes.
+
+    El pool es compartido: si otra sesión descarga a la vez, sus tareas
+    también aparecen en las muestras de los workers.
+    """
+
+    _tracemalloc_lock = threading.Lock()
+    _tracemalloc_users = 0
+    _tracemalloc_owned = False
+
+    def __init__(self, output_dir, enabled, job_name="job"):
+        self.output_dir = output_dir
+        self.enabled = enabled
+        self.job_name = job_name
+        self.summary = None
+        self.profile_dir = None
+        self._stacks = Counter()
+        self._samples = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        with JobProfiler._tracemalloc_lock:
+            if JobProfiler._tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                JobProfiler._tracemalloc_owned = True
+            JobProfiler._tracemalloc_users += 1
+        tracemalloc.reset_peak()
+        self._start_snapshot = tracemalloc.take_snapshot()
+        self._started_at = datetime.now()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._script_thread = threading.get_ident()
+        self._sampler = threading.Thread(target=self._sample, name="music-finder-profiler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def _is_job_thread(self, thread_id, name):
+        # El servidor de exportación y los perfiladores de otras sesiones no cuentan
+        return thread_id == self._script_thread or _JOB_THREAD_PATTERN.fullmatch(name) is not None
+
+    def _sample(self):
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if not self._is_job_thread(thread_id, names.get(thread_id, '')):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                # Workers parados esperando una tarea (pool compartido o ThreadPoolExecutor)
+                if any(code.co_name == '_worker' and following.co_name in ('wait', 'get')
+                       for code, following in zip(stack, stack[1:])):
+                    continue
+                self._stacks[tuple(stack)] += 1
+            self._samples += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        self._stop.set()
+        self._sampler.join()
+        wall = time.perf_counter() - self._start_wall
+        cpu = time.process_time() - self._start_cpu
+        end_snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        with JobProfiler._tracemalloc_lock:
+            JobProfiler._tracemalloc_users -= 1
+            if JobProfiler._tracemalloc_users == 0 and JobProfiler._tracemalloc_owned:
+                tracemalloc.stop()
+                JobProfiler._tracemalloc_owned = False
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        end_snapshot = end_snapshot.filter_traces(ignore)
+        allocations = end_snapshot.compare_to(self._start_snapshot.filter_traces(ignore), 'lineno')
+        self.summary = self._build_summary(wall, cpu, peak, allocations)
+
+        try:
+            self.profile_dir = os.path.join(self.output_dir, PROFILE_DIR_NAME)
+            os.makedirs(self.profile_dir, exist_ok=True)
+            stem = os.path.join(self.profile_dir, f"{self.job_name}_{self._started_at:%Y%m%d_%H%M%S}")
+            with open(f"{stem}.folded", 'w', encoding='utf-8') as f:
+                for stack, count in self._stacks.most_common():
+                    f.write(";".join(_frame_label(code) for code in stack) + f" {count}\n")
+            with open(f"{stem}.txt", 'w', encoding='utf-8') as f:
+                f.write(self.summary)
+            end_snapshot.dump(f"{stem}.tracemalloc")
+        except OSError as e:
+            self.summary += f"\n⚠️ No se pudo guardar el perfil: {e}\n"
+            self.profile_dir = None
+        return False
+
+    def _build_summary(self, wall, cpu, peak, allocations):
+        total = sum(self._stacks.values()) or 1
+        self_time = Counter()
+        cumulative = Counter()
+        for stack, count in self._stacks.items():
+            self_time[stack[-1]] += count
+            # El arranque de los hilos aparece en todas las pilas y no aporta nada
+            for code in set(stack):
+                if code.co_filename != threading.__file__:
+                    cumulative[code] += count
+
+        lines = [
+            f"Perfil de {self.job_name} ({self._started_at:%Y-%m-%d %H:%M:%S})",
+            f"Duración: {wall:.1f} s | CPU del proceso: {cpu:.1f} s | "
+            f"Muestras: {self._samples} cada {PROFILE_SAMPLE_INTERVAL * 1000:.0f} ms",
+            f"Memoria: pico {format_bytes(peak)}, "
+            f"neto {_signed_bytes(sum(stat.size_diff for stat in allocations))}",
+            "",
+            "Funciones más calientes (tiempo propio, incluye esperas):",
+        ]
+        lines += [f"  {count / total:6.1%}  {_frame_label(code)}" for code, count in self_time.most_common(PROFILE_TOP_N)]
+        lines += ["", "Funciones más calientes (tiempo acumulado):"]
+        lines += [f"  {count / total:6.1%}  {_frame_label(code)}" for code, count in cumulative.most_common(PROFILE_TOP_N)]
+        lines += ["", "Puntos de asignación (crecimiento neto durante el trabajo):"]
+        lines += [
+            f"  {_signed_bytes(stat.size_diff):>11} ({stat.count_diff:+d} bloques)  {stat.traceback[0].filename}:{stat.traceback[0].lineno}"
+            for stat in allocations[:PROFILE_TOP_N]
+        ]
+        return "\n".join(lines) + "\n"
+
+def show_profile_summary(profiler):
+    """Muestra el resumen del perfil de un trabajo, si se activó"""
+    if profiler.summary:
+        with st.expander("🔬 Perfil del trabajo"):
+            st.code(profiler.summary)
+            if profiler.profile_dir:
+                st.caption(f"Perfiles guardados en: {profiler.profile_dir}")
+
 def main():
     st.title("🎵 Music Link Finder & Downloader")
     st.write("Carga un archivo JSON con información de canciones para encontrar enlaces de YouTube o descargar MP3")
@@ -87,6 +1567,28 @@ def main():
         # Upload file
         uploaded_file = st.file_uploader("Selecciona un archivo JSON", type=['json'], key="search_json")
         
+        # Modo sincronización: solo se buscan las canciones nuevas
+        sync_mode = st.checkbox("🔄 Modo sincronización (comparar con resultados anteriores)", key="sync_mode")
+        previous_file = None
+        use_library = False
+        archive_removed = False
+        if sync_mode:
+            sync_source = st.radio(
+                "Comparar con:",
+                ["📄 Resultados anteriores (JSON)", "📚 Biblioteca local"],
+                key="sync_source"
+            )
+            use_library = sync_source == "📚 Biblioteca local"
+            if not use_library:
+                previous_file = st.file_uploader(
+                    "Resultados anteriores (ej: music_results_100percent.json)",
+                    type=['json'],
+                    key="previous_results_json"
+                )
+                archive_removed = st.checkbox("Archivar canciones eliminadas de la playlist", value=True, key="archive_removed")
+            else:
+                st.caption("La biblioteca mezcla todas las playlists: no se detectan canciones eliminadas")
+        
         if uploaded_file is not None:
             try:
                 # Leer JSON
@@ -97,9 +1599,40 @@ def main():
                 with st.expander("Vista previa de los datos"):
                     st.json(json_data[:3] if len(json_data) > 3 else json_data)
                 
+                # Calcular diferencias con los resultados anteriores
+                songs_to_search = json_data
+                base_results = []
+                removed_songs = []
+                previous_results = None
+                if sync_mode and use_library:
+                    # Solo las canciones de esta playlist: el resto de la biblioteca no cuenta como eliminada
+                    result_store = get_result_store()
+                    previous_results = result_store.export_results(result_store.find_keys(
+                        track_key(song.get('Track Name'), song.get('Artist Name(s)'), song.get('Album Name'))
+                        for song in json_data
+                    ))
+                elif sync_mode and previous_file is not None:
+                    previous_results = json.load(previous_file)
+                if previous_results is not None:
+                    songs_to_search, removed_songs, base_results = diff_playlist(json_data, previous_results)
+                    
+                    if use_library:
+                        col1, col3 = st.columns(2)
+                    else:
+                        col1, col2, col3 = st.columns(3)
+                        col2.metric("Eliminadas", len(removed_songs))
+                    col1.metric("Nuevas", len(songs_to_search))
+                    col3.metric("Sin cambios", len(base_results))
+                
+                hedge_searches = st.checkbox(
+                    "⚡ Repetir búsquedas lentas (la primera respuesta gana)",
+                    value=True,
+                    key="hedge_searches"
+                )
+                
                 # Botón para iniciar procesamiento
                 if st.button("🚀 Iniciar búsqueda de enlaces"):
-                    total_songs = len(json_data)
+                    total_songs = len(songs_to_search)
                     progress_bar = st.progress(0)
                     status_text = st.empty()
                     results_container = st.empty()
@@ -110,105 +1643,214 @@ def main():
                     # Crear directorio temporal para archivos
                     temp_dir = tempfile.mkdtemp()
                     
-                    for i, song_data in enumerate(json_data):
+                    with JobProfiler(temp_dir, st.session_state.get('profiling_mode', False), 'search') as profiler:
+                        # Extraer información de las canciones y enviar las búsquedas al pool compartido
+                        search_args = [
+                            (song_data.get('Track Name', ''), song_data.get('Album Name', ''), song_data.get('Artist Name(s)', ''))
+                            for song_data in songs_to_search
+                        ]
+                        search_cache = get_search_cache()
+                        search_futures = submit_batch(
+                            partial(search_youtube_link, cache=search_cache, searcher=get_hedged_searcher(), hedge=hedge_searches),
+                            search_args
+                        )
+                        
                         try:
-                            # Extraer información de la canción
-                            track_name = song_data.get('Track Name', '')
-                            album_name = song_data.get('Album Name', '')
-                            artist_names = song_data.get('Artist Name(s)', '')
-                            
-                            status_text.text(f"Procesando: {track_name} - {artist_names}")
-                            
-                            # Buscar enlace de YouTube
-                            youtube_link = search_youtube_link(track_name, album_name, artist_names)
-                            
-                            # Agregar resultado
-                            result = {
-                                'track': track_name,
-                                'album': album_name,
-                                'artist': artist_names,
-                                'youtube_link': youtube_link,
-                                'processed_at': datetime.now().isoformat()
-                            }
-                            results.append(result)
-                            processed_count += 1
-                            
-                            # Actualizar barra de progreso
-                            progress_percentage = processed_count / total_songs
-                            progress_bar.progress(progress_percentage)
-                            
-                            # Verificar si se completó un 5% adicional
-                            if processed_count % max(1, total_songs // 20) == 0 or processed_count == total_songs:
-                                percentage = int((processed_count / total_songs) * 100)
-                                
-                                # Crear archivo JSON
-                                json_filename = f"music_results_{percentage}percent.json"
-                                json_filepath = os.path.join(temp_dir, json_filename)
-                                with open(json_filepath, 'w', encoding='utf-8') as f:
-                                    json.dump(results, f, ensure_ascii=False, indent=2)
-                                
-                                # Crear archivo TXT
-                                txt_filename = f"music_list_{percentage}percent.txt"
-                                txt_filepath = os.path.join(temp_dir, txt_filename)
-                                txt_content = create_txt_content(results)
-                                with open(txt_filepath, 'w', encoding='utf-8') as f:
-                                    f.write(txt_content)
-                                
-                                # Mostrar botones de descarga
-                                col1, col2 = st.columns(2)
-                                
-                                with col1:
-                                    with open(json_filepath, 'rb') as f:
+                            for i, (song_data, (track_name, album_name, artist_names), future) in enumerate(zip(songs_to_search, search_args, search_futures)):
+                                try:
+                                    status_text.text(f"Procesando: {track_name} - {artist_names}")
+                        
+                                    # Esperar el enlace de YouTube (los resultados se recogen en orden)
+                                    youtube_link = future.result()
+                        
+                                    # Agregar resultado
+                                    result = {
+                                        'track': track_name,
+                                        'album': album_name,
+                                        'artist': artist_names,
+                                        'youtube_link': youtube_link,
+                                        'track_number': song_data.get('Track Number'),
+                                        'album_image_url': song_data.get('Album Image URL'),
+                                        'processed_at': datetime.now().isoformat()
+                                    }
+                                    results.append(result)
+                                    processed_count += 1
+                        
+                                    # Actualizar barra de progreso
+                                    progress_percentage = processed_count / total_songs
+                                    progress_bar.progress(progress_percentage)
+                        
+                                    # Verificar si se completó un 5% adicional
+                                    if processed_count % max(1, total_songs // 20) == 0 or processed_count == total_songs:
+                                        percentage = int((processed_count / total_songs) * 100)
+                        
+                                        # Crear archivo JSON
+                                        json_filename = f"music_results_{percentage}percent.json"
+                                        json_filepath = os.path.join(temp_dir, json_filename)
+                                        with open(json_filepath, 'w', encoding='utf-8') as f:
+                                            json.dump(base_results + results, f, ensure_ascii=False, indent=2)
+                        
+                                        # Crear archivo TXT
+                                        txt_filename = f"music_list_{percentage}percent.txt"
+                                        txt_filepath = os.path.join(temp_dir, txt_filename)
+                                        txt_content = create_txt_content(base_results + results)
+                                        with open(txt_filepath, 'w', encoding='utf-8') as f:
+                                            f.write(txt_content)
+                        
+                                        # Mostrar botones de descarga
+                                        col1, col2 = st.columns(2)
+                        
+                                        with col1:
+                                            with open(json_filepath, 'rb') as f:
+                                                st.download_button(
+                                                    label=f"📄 Descargar JSON ({percentage}%)",
+                                                    data=f.read(),
+                                                    file_name=json_filename,
+                                                    mime='application/json',
+                                                    key=f"json_{percentage}"
+                                                )
+                        
+                                        with col2:
+                                            with open(txt_filepath, 'rb') as f:
+                                                st.download_button(
+                                                    label=f"📝 Descargar TXT ({percentage}%)",
+                                                    data=f.read(),
+                                                    file_name=txt_filename,
+                                                    mime='text/plain',
+                                                    key=f"txt_{percentage}"
+                                                )
+                        
+                                except Exception as e:
+                                    st.error(f"Error procesando canción {i+1}: {str(e)}")
+                                    continue
+                        
+                        finally:
+                            cancel_pending(search_futures)
+                            search_cache.save()
+                            # Guardar en la biblioteca local
+                            get_result_store().upsert_results(base_results + results)
+                        
+                        # En modo sincronización se guardan por separado las adiciones y las eliminadas
+                        if previous_results is not None:
+                            sync_files = [
+                                ("music_results_100percent.json", base_results + results, "📄 Descargar JSON completo"),
+                                ("music_added.json", results, "➕ Descargar solo nuevas (para Descargar MP3)"),
+                            ]
+                            if archive_removed and removed_songs:
+                                sync_files.append(("music_removed_archive.json", removed_songs, "🗄️ Descargar archivo de eliminadas"))
+                        
+                            for column, (sync_filename, sync_data, sync_label) in zip(st.columns(len(sync_files)), sync_files):
+                                sync_filepath = os.path.join(temp_dir, sync_filename)
+                                with open(sync_filepath, 'w', encoding='utf-8') as f:
+                                    json.dump(sync_data, f, ensure_ascii=False, indent=2)
+                                with column:
+                                    with open(sync_filepath, 'rb') as f:
                                         st.download_button(
-                                            label=f"📄 Descargar JSON ({percentage}%)",
+                                            label=sync_label,
                                             data=f.read(),
-                                            file_name=json_filename,
+                                            file_name=sync_filename,
                                             mime='application/json',
-                                            key=f"json_{percentage}"
-                                        )
-                                
-                                with col2:
-                                    with open(txt_filepath, 'rb') as f:
-                                        st.download_button(
-                                            label=f"📝 Descargar TXT ({percentage}%)",
-                                            data=f.read(),
-                                            file_name=txt_filename,
-                                            mime='text/plain',
-                                            key=f"txt_{percentage}"
+                                            key=f"sync_{sync_filename}"
                                         )
                         
-                        except Exception as e:
-                            st.error(f"Error procesando canción {i+1}: {str(e)}")
-                            continue
-                    
-                    # Mostrar resultados finales
-                    status_text.text("✅ Procesamiento completado!")
-                    
-                    # Estadísticas finales
-                    found_count = sum(1 for r in results if r['youtube_link'] != "NO ENCONTRADO" and not r['youtube_link'].startswith("ERROR"))
-                    not_found_count = len(results) - found_count
-                    
-                    col1, col2, col3 = st.columns(3)
-                    col1.metric("Total procesadas", len(results))
-                    col2.metric("Encontradas", found_count)
-                    col3.metric("No encontradas", not_found_count)
+                        # Mostrar resultados finales
+                        status_text.text("✅ Procesamiento completado!")
+                        
+                        # Estadísticas finales
+                        found_count = sum(1 for r in results if r['youtube_link'] != "NO ENCONTRADO" and not r['youtube_link'].startswith("ERROR"))
+                        not_found_count = len(results) - found_count
+                        
+                        col1, col2, col3 = st.columns(3)
+                        col1.metric("Total procesadas", len(results))
+                        col2.metric("Encontradas", found_count)
+                        col3.metric("No encontradas", not_found_count)
+                        
+                        # Mostrar tabla de resultados
+                        st.subheader("Resultados:")
+                        for result in results:
+                            with st.expander(f"🎵 {result['track']} - {result['artist']}"):
+                                st.write(f"**Álbum:** {result['album']}")
+                                if result['youtube_link'] == "NO ENCONTRADO":
+                                    st.error("❌ No se encontró enlace")
+                                elif result['youtube_link'].startswith("ERROR"):
+                                    st.error(f"❌ {result['youtube_link']}")
+                                else:
+                                    st.success(f"✅ [Ver en YouTube]({result['youtube_link']})")
                     
-                    # Mostrar tabla de resultados
-                    st.subheader("Resultados:")
-                    for result in results:
-                        with st.expander(f"🎵 {result['track']} - {result['artist']}"):
-                            st.write(f"**Álbum:** {result['album']}")
-                            if result['youtube_link'] == "NO ENCONTRADO":
-                                st.error("❌ No se encontró enlace")
-                            elif result['youtube_link'].startswith("ERROR"):
-                                st.error(f"❌ {result['youtube_link']}")
-                            else:
-                                st.success(f"✅ [Ver en YouTube]({result['youtube_link']})")
+                    show_profile_summary(profiler)
         
             except json.JSONDecodeError:
                 st.error("❌ Error: El archivo no es un JSON válido")
             except Exception as e:
                 st.error(f"❌ Error procesando el archivo: {str(e)}")
+        
+        # Consultar la biblioteca local
+        with st.expander("📚 Biblioteca local"):
+            result_store = get_result_store()
+            status_counts = result_store.count_by_status()
+            st.write(f"**Canciones en la biblioteca:** {sum(status_counts.values())}")
+            if status_counts:
+                st.write(" | ".join(f"{status}: {count}" for status, count in sorted(status_counts.items())))
+            
+            # La consulta solo se lanza al pulsar el botón, no en cada recarga de la página
+            with st.form("library_query"):
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    library_artist = st.text_input("Artista (empieza por):", key="library_artist")
+                with col2:
+                    library_status = st.selectbox(
+                        "Estado:",
+                        ["", "ENCONTRADO", "NO ENCONTRADO", "ERROR", "DESCARGADO", "ERROR DESCARGA"],
+                        key="library_status"
+                    )
+                with col3:
+                    library_video_id = st.text_input("ID de video:", key="library_video_id")
+                library_search = st.form_submit_button("🔎 Consultar")
+            
+            if library_search:
+                library_filters = {
+                    'video_id': library_video_id.strip() or None,
+                    'artist': library_artist.strip() or None,
+                    'status': library_status or None,
+                }
+                st.session_state['library_filters'] = library_filters
+                st.session_state['library_rows'] = [
+                    dict(row) for row in result_store.find(**library_filters, limit=LIBRARY_PAGE_SIZE)
+                ]
+                st.session_state.pop('library_export_json', None)
+            
+            if 'library_rows' in st.session_state:
+                library_rows = st.session_state['library_rows']
+                if len(library_rows) >= LIBRARY_PAGE_SIZE:
+                    st.write(f"Resultados: se muestran los primeros {LIBRARY_PAGE_SIZE}")
+                else:
+                    st.write(f"Resultados: {len(library_rows)}")
+                st.dataframe(library_rows)
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                # El JSON completo de la selección solo se genera cuando se pide
+                if 'library_filters' in st.session_state and st.button("📄 Preparar exportación a JSON", key="library_export_prepare"):
+                    st.session_state['library_export_json'] = json.dumps(
+                        result_store.export_results(result_store.find(**st.session_state['library_filters'])),
+                        ensure_ascii=False, indent=2
+                    )
+                if 'library_export_json' in st.session_state:
+                    st.download_button(
+                        label="📄 Exportar selección a JSON",
+                        data=st.session_state['library_export_json'],
+                        file_name="music_library.json",
+                        mime='application/json',
+                        key="library_export"
+                    )
+            with col2:
+                library_import = st.file_uploader("Importar JSON de resultados", type=['json'], key="library_import")
+                if library_import is not None and st.button("📥 Importar a la biblioteca", key="library_import_button"):
+                    try:
+                        result_store.upsert_results(json.load(library_import))
+                        st.success("✅ Resultados importados")
+                    except Exception as e:
+                        st.error(f"❌ Error importando: {str(e)}")
     
     with tab2:
         st.header("Descargar MP3 desde JSON")
@@ -301,6 +1943,12 @@ def main():
                 
                 st.info(f"📥 Formato de descarga: {format_type}")
                 
+                preflight_option = st.checkbox(
+                    "🔎 Verificar disponibilidad y tamaño antes de descargar",
+                    value=True,
+                    key="preflight_option"
+                )
+                
                 # Botón para iniciar descarga
                 download_button_text = "⬇️ Iniciar descarga de MP3" if (ffmpeg_installed and not use_alternative) else "⬇️ Iniciar descarga de Audio"
                 
@@ -309,76 +1957,172 @@ def main():
                         st.error("❌ No hay canciones válidas para descargar")
                         return
                     
-                    download_progress = st.progress(0)
-                    download_status = st.empty()
-                    
-                    successful_downloads = 0
-                    failed_downloads = 0
-                    
-                    songs_to_download = valid_songs[:max_downloads]
-                    
-                    for i, song in enumerate(songs_to_download):
-                        try:
+                    with JobProfiler(download_path, st.session_state.get('profiling_mode', False), 'download') as profiler:
+                        download_progress = st.progress(0)
+                        download_status = st.empty()
+                        
+                        successful_downloads = 0
+                        failed_downloads = 0
+                        
+                        songs_to_download = valid_songs[:max_downloads]
+                        use_mp3 = ffmpeg_installed and not use_alternative
+                        unavailable_results = []
+                        
+                        # Verificación previa en paralelo: descarta vídeos no disponibles antes de bajar nada
+                        if preflight_option:
+                            preflight_format = 'bestaudio/best' if use_mp3 else build_audio_opts(quality, False)['format']
+                            preflight_futures = submit_batch(
+                                preflight_video,
+                                [(song.get('youtube_link', ''), preflight_format) for song in songs_to_download]
+                            )
+                            preflights = [None] * len(songs_to_download)
+                            future_indexes = {future: i for i, future in enumerate(preflight_futures)}
+                            preflight_progress = BatchProgress(len(songs_to_download))
+                            preflight_ui = ThrottledProgressUI(download_progress, download_status, preflight_progress)
+                            preflight_ui.refresh("Verificando disponibilidad", force=True)
+                            try:
+                                for future in iter_completed(preflight_futures, on_tick=preflight_ui.refresh):
+                                    preflights[future_indexes[future]] = future.result()
+                                    preflight_progress.item_done(future_indexes[future])
+                                    preflight_ui.refresh()
+                            finally:
+                                cancel_pending(preflight_futures)
+                            preflight_ui.refresh(force=True)
+                        
+                            available = []
+                            for song, preflight in zip(songs_to_download, preflights):
+                                if preflight['available']:
+                                    available.append((preflight['size'], song))
+                                else:
+                                    unavailable_results.append(dict(song, download_status=f"NO DISPONIBLE: {preflight['reason']}"))
+                        
+                            # Los más pequeños primero: más canciones terminadas por minuto
+                            available.sort(key=lambda item: item[0])
+                            songs_to_download = [song for _, song in available]
+                        
+                            total_size = sum(size for size, _ in available)
+                            total_duration = sum(p['duration'] for p in preflights if p['available'])
+                            expected_rate = get_bandwidth_limiter().rate or ASSUMED_DOWNLOAD_RATE * min(SESSION_CONCURRENCY_CAP, max(1, len(available)))
+                        
+                            col1, col2, col3, col4 = st.columns(4)
+                            col1.metric("Disponibles", len(available))
+                            col2.metric("No disponibles", len(unavailable_results))
+                            col3.metric("Tamaño estimado", format_bytes(total_size))
+                            col4.metric("ETA estimada", format_eta(total_size / expected_rate))
+                            st.write(f"⏱️ Duración total: {format_eta(total_duration)}")
+                            unverified_count = sum(1 for p in preflights if p.get('error'))
+                            if unverified_count:
+                                st.info(f"ℹ️ {unverified_count} canciones no se pudieron verificar (error de red u otro fallo); se intentará descargarlas igualmente")
+                        
+                            if unavailable_results:
+                                with st.expander(f"⚠️ Canciones no disponibles ({len(unavailable_results)})"):
+                                    for result in unavailable_results:
+                                        st.write(f"🎵 {result.get('track', 'N/A')} - {result.get('artist', 'N/A')}: {result['download_status']}")
+                        
+                        batch_progress = BatchProgress(len(songs_to_download))
+                        progress_ui = ThrottledProgressUI(download_progress, download_status, batch_progress)
+                        
+                        # Preparar las descargas y enviarlas al pool compartido
+                        bandwidth_limiter = get_bandwidth_limiter()
+                        disk_budget = get_disk_budget()
+                        manifest = get_output_manifest(download_path)
+                        download_args = []
+                        for song in songs_to_download:
                             track_name = song.get('track', 'Unknown')
                             artist_name = song.get('artist', 'Unknown')
-                            youtube_link = song.get('youtube_link', '')
-                            
+                        
                             # Limpiar nombres de archivo
-                            safe_artist = "".join(c for c in artist_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                            safe_track = "".join(c for c in track_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                            
-                            download_status.text(f"Descargando: {track_name} - {artist_name}")
-                            
-                            # Configurar yt-dlp según disponibilidad de FFmpeg
-                            if ffmpeg_installed and not use_alternative:
-                                # Configuración para MP3 con FFmpeg
-                                ydl_opts = {
-                                    'format': 'bestaudio/best',
-                                    'outtmpl': os.path.join(download_path, f'{safe_artist} - {safe_track}.%(ext)s'),
-                                    'postprocessors': [{
-                                        'key': 'FFmpegExtractAudio',
-                                        'preferredcodec': 'mp3',
-                                        'preferredquality': quality,
-                                    }],
-                                    'quiet': True,
-                                    'no_warnings': True,
+                            file_name = sanitize_filename(f"{artist_name or 'Unknown'} - {track_name or 'Unknown'}")
+                        
+                            if use_mp3:
+                                # MP3 con etiquetas ID3 y portada en una sola pasada de FFmpeg
+                                ydl_opts = {'format': 'bestaudio/best', 'noplaylist': True, 'quiet': True, 'no_warnings': True}
+                                ydl_opts['progress_hooks'] = [batch_progress.hook(len(download_args)), bandwidth_limiter.hook()]
+                                tags = {
+                                    'title': song.get('track'),
+                                    'artist': song.get('artist'),
+                                    'album': song.get('album'),
+                                    'track': song.get('track_number'),
                                 }
+                                download_args.append((
+                                    song.get('youtube_link', ''),
+                                    ydl_opts,
+                                    manifest,
+                                    file_name,
+                                    quality,
+                                    tags,
+                                    song.get('album_image_url'),
+                                    disk_budget,
+                                ))
                             else:
                                 # Configuración sin FFmpeg (audio original)
-                                ydl_opts = {
-                                    'format': f'bestaudio[ext=m4a]/bestaudio/best' if quality == 'best' else 'worstaudio',
-                                    'outtmpl': os.path.join(download_path, f'{safe_artist} - {safe_track}.%(ext)s'),
-                                    'quiet': True,
-                                    'no_warnings': True,
-                                }
-                            
-                            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                ydl.download([youtube_link])
-                                successful_downloads += 1
-                                
-                        except Exception as e:
-                            failed_downloads += 1
-                            st.error(f"❌ Error descargando {track_name}: {str(e)}")
+                                ydl_opts = build_audio_opts(quality, False)
+                                ydl_opts['progress_hooks'] = [batch_progress.hook(len(download_args)), bandwidth_limiter.hook()]
+                                download_args.append((song.get('youtube_link', ''), ydl_opts, manifest, file_name, '', disk_budget))
                         
-                        # Actualizar progreso
-                        progress = (i + 1) / len(songs_to_download)
-                        download_progress.progress(progress)
-                    
-                    # Mostrar resultados finales
-                    download_status.text("✅ Descarga completada!")
-                    
-                    col1, col2, col3 = st.columns(3)
-                    col1.metric("Exitosas", successful_downloads)
-                    col2.metric("Fallidas", failed_downloads)
-                    col3.metric("Total", len(songs_to_download))
-                    
-                    st.success(f"🎵 Descargas completadas en: {download_path}")
+                        download_futures = submit_batch(download_tagged_mp3 if use_mp3 else run_download, download_args)
+                        future_indexes = {future: i for i, future in enumerate(download_futures)}
+                        progress_ui.refresh("Descargando", force=True)
+                        
+                        output_files = []
+                        download_results = [dict(song) for song in songs_to_download]
+                        download_results.extend(unavailable_results)
+                        
+                        try:
+                            for future in iter_completed(download_futures, progress_ui.refresh):
+                                i = future_indexes[future]
+                                song = songs_to_download[i]
+                                track_name = song.get('track', 'Unknown')
+                                artist_name = song.get('artist', 'Unknown')
+                                try:
+                                    output_files.extend(future.result())
+                                    successful_downloads += 1
+                                    download_results[i]['download_status'] = "DESCARGADO"
+                                    progress_ui.message = f"Descargado: {track_name} - {artist_name}"
+                                except Exception as e:
+                                    failed_downloads += 1
+                                    download_results[i]['download_status'] = f"ERROR: {str(e)}"
+                                    st.error(f"❌ Error descargando {track_name}: {str(e)}")
+                        
+                                # Actualizar progreso
+                                batch_progress.item_done(i)
+                        finally:
+                            cancel_pending(download_futures)
+                            get_result_store().set_download_status(
+                                (r.get('youtube_link'), "DESCARGADO" if r['download_status'] == "DESCARGADO" else "ERROR DESCARGA")
+                                for r in download_results if 'download_status' in r
+                            )
+                        progress_ui.refresh(force=True)
+                        
+                        # Mostrar resultados finales
+                        download_status.text("✅ Descarga completada!")
+                        
+                        col1, col2, col3, col4 = st.columns(4)
+                        col1.metric("Exitosas", successful_downloads)
+                        col2.metric("Fallidas", failed_downloads)
+                        col3.metric("No disponibles", len(unavailable_results))
+                        col4.metric("Total", len(songs_to_download) + len(unavailable_results))
+                        
+                        st.success(f"🎵 Descargas completadas en: {download_path}")
+                        
+                        offer_batch_export(
+                            f"download_results_{datetime.now():%Y%m%d_%H%M%S}",
+                            output_files,
+                            download_results,
+                            create_txt_content([
+                                {'track': r.get('track', ''), 'album': r.get('album', ''), 'artist': r.get('artist', ''),
+                                 'youtube_link': r.get('youtube_link', '')}
+                                for r in download_results
+                            ])
+                        )
+                        
+                        if not ffmpeg_installed or use_alternative:
+                            st.info("""
+                            📝 **Nota:** Los archivos se descargaron en formato de audio original.
+                            Para convertir a MP3, instala FFmpeg y usa la descarga normal.
+                            """)
                     
-                    if not ffmpeg_installed or use_alternative:
-                        st.info("""
-                        📝 **Nota:** Los archivos se descargaron en formato de audio original.
-                        Para convertir a MP3, instala FFmpeg y usa la descarga normal.
-                        """)
+                    show_profile_summary(profiler)
                     
             except json.JSONDecodeError:
                 st.error("❌ Error: El archivo no es un JSON válido")
@@ -404,7 +2148,7 @@ def main():
         links_text = st.text_area(
             "Pega los enlaces aquí (uno por línea):",
             height=200,
-            placeholder="https://www.youtube.com/watch?v=dQw4w9WgXcQ\nhttps://www.youtube.com/watch?v=...\nhttps://www.youtube.com/watch?v=...",
+            placeholder="https://www.youtube.com/watch?v=dQw4w9WgXcQ\nhttps://www.youtube.com/playlist?list=...\nhttps://www.youtube.com/@canal",
             key="bulk_links"
         )
         
@@ -412,24 +2156,17 @@ def main():
         if links_text:
             # Parse links
             raw_links = [link.strip() for link in links_text.split('\n') if link.strip()]
-            valid_links = []
             
-            for link in raw_links:
-                if 'youtube.com/watch?v=' in link or 'youtu.be/' in link:
-                    # Normalize YouTube links
-                    if 'youtu.be/' in link:
-                        video_id = link.split('youtu.be/')[-1].split('?')[0]
-                        normalized_link = f"https://www.youtube.com/watch?v={video_id}"
-                    else:
-                        normalized_link = link
-                    valid_links.append(normalized_link)
+            # Normalize YouTube links (playlists and channels are expanded during the download)
+            valid_links = [link for link in map(normalize_youtube_link, raw_links) if link]
+            has_playlists_bulk = any(is_playlist_link(link) for link in valid_links)
             
             st.success(f"Enlaces válidos encontrados: {len(valid_links)}")
             
             if valid_links:
                 with st.expander("Vista previa de enlaces"):
                     for i, link in enumerate(valid_links[:10], 1):
-                        st.write(f"{i}. {link}")
+                        st.write(f"{i}. {link}" + (" (lista/canal)" if is_playlist_link(link) else ""))
                     if len(valid_links) > 10:
                         st.write(f"... y {len(valid_links) - 10} más")
         
@@ -463,8 +2200,8 @@ def main():
                 max_downloads_bulk = st.number_input(
                     "Máximo de descargas:", 
                     min_value=1, 
-                    max_value=len(valid_links), 
-                    value=min(len(valid_links), 20),
+                    max_value=None if has_playlists_bulk else len(valid_links), 
+                    value=20 if has_playlists_bulk else min(len(valid_links), 20),
                     key="bulk_max"
                 )
             
@@ -486,74 +2223,78 @@ def main():
                     st.error("❌ No hay enlaces válidos para descargar")
                     return
                 
-                bulk_progress = st.progress(0)
-                bulk_status = st.empty()
-                
-                successful_bulk = 0
-                failed_bulk = 0
-                
-                links_to_download = valid_links[:max_downloads_bulk]
-                
-                for i, youtube_link in enumerate(links_to_download):
-                    try:
-                        bulk_status.text(f"Descargando {i+1}/{len(links_to_download)}: {youtube_link}")
-                        
+                with JobProfiler(download_path_bulk, st.session_state.get('profiling_mode', False), 'bulk') as profiler:
+                    bulk_progress = st.progress(0)
+                    bulk_status = st.empty()
+                    
+                    successful_bulk = 0
+                    failed_bulk = 0
+                    
+                    bulk_batch_progress = BatchProgress(0 if has_playlists_bulk else min(len(valid_links), max_downloads_bulk))
+                    bulk_progress_ui = ThrottledProgressUI(bulk_progress, bulk_status, bulk_batch_progress)
+                    
+                    bandwidth_limiter = get_bandwidth_limiter()
+                    disk_budget = get_disk_budget()
+                    manifest = get_output_manifest(download_path_bulk)
+                    
+                    def submit_bulk(i, youtube_link):
                         # Configure filename based on naming option
-                        if naming_option == "Numerado secuencial":
-                            filename_template = f"{i+1:03d}_%(title)s.%(ext)s"
-                        else:
-                            filename_template = "%(title)s.%(ext)s"
-                        
+                        name_prefix = f"{i+1:03d}_" if naming_option == "Numerado secuencial" else ''
+                    
                         # Configure yt-dlp for bulk download
-                        if ffmpeg_installed and not use_alternative_bulk:
-                            # MP3 configuration with FFmpeg
-                            ydl_opts_bulk = {
-                                'format': 'bestaudio/best',
-                                'outtmpl': os.path.join(download_path_bulk, filename_template),
-                                'postprocessors': [{
-                                    'key': 'FFmpegExtractAudio',
-                                    'preferredcodec': 'mp3',
-                                    'preferredquality': quality_bulk,
-                                }],
-                                'quiet': True,
-                                'no_warnings': True,
-                            }
-                        else:
-                            # Configuration without FFmpeg (original audio)
-                            ydl_opts_bulk = {
-                                'format': f'bestaudio[ext=m4a]/bestaudio/best' if quality_bulk == 'best' else 'worstaudio',
-                                'outtmpl': os.path.join(download_path_bulk, filename_template),
-                                'quiet': True,
-                                'no_warnings': True,
-                            }
-                        
-                        with yt_dlp.YoutubeDL(ydl_opts_bulk) as ydl:
-                            ydl.download([youtube_link])
+                        ydl_opts_bulk = build_audio_opts(quality_bulk, ffmpeg_installed and not use_alternative_bulk)
+                        ydl_opts_bulk['progress_hooks'] = [bulk_batch_progress.hook(i), bandwidth_limiter.hook()]
+                        if has_playlists_bulk:
+                            bulk_batch_progress.add_items(1)
+                        return submit_task(run_download, youtube_link, ydl_opts_bulk, manifest, None, name_prefix,
+                                           disk_budget, interactive=max_downloads_bulk <= SMALL_JOB_THRESHOLD)
+                    
+                    def report_playlist_error(link, error):
+                        st.error(f"❌ Error leyendo la lista {link}: {str(error)}")
+                    
+                    # Playlists and channels are expanded page by page while the downloads run
+                    links_to_download = islice(iter_video_urls(valid_links, on_error=report_playlist_error), max_downloads_bulk)
+                    bulk_progress_ui.refresh("Descargando", force=True)
+                    
+                    bulk_output_files = []
+                    bulk_results = []
+                    
+                    for i, youtube_link, future in iter_streamed(links_to_download, submit_bulk, on_tick=bulk_progress_ui.refresh):
+                        try:
+                            files = future.result()
+                            bulk_output_files.extend(files)
                             successful_bulk += 1
-                            
-                    except Exception as e:
-                        failed_bulk += 1
-                        st.error(f"❌ Error descargando {youtube_link}: {str(e)}")
+                            bulk_results.append({'youtube_link': youtube_link, 'download_status': "DESCARGADO",
+                                                 'files': [os.path.basename(path) for path in files]})
+                            bulk_progress_ui.message = f"Descargado: {youtube_link}"
+                        except Exception as e:
+                            failed_bulk += 1
+                            bulk_results.append({'youtube_link': youtube_link, 'download_status': f"ERROR: {str(e)}"})
+                            st.error(f"❌ Error descargando {youtube_link}: {str(e)}")
                     
-                    # Update progress
-                    progress_bulk = (i + 1) / len(links_to_download)
-                    bulk_progress.progress(progress_bulk)
-                
-                # Show final results
-                bulk_status.text("✅ Descarga masiva completada!")
-                
-                col1, col2, col3 = st.columns(3)
-                col1.metric("Exitosas", successful_bulk)
-                col2.metric("Fallidas", failed_bulk)
-                col3.metric("Total", len(links_to_download))
-                
-                st.success(f"🎵 Descarga masiva completada en: {download_path_bulk}")
+                        # Update progress
+                        bulk_batch_progress.item_done(i)
+                    bulk_progress_ui.refresh(force=True)
+                    
+                    # Show final results
+                    bulk_status.text("✅ Descarga masiva completada!")
+                    
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric("Exitosas", successful_bulk)
+                    col2.metric("Fallidas", failed_bulk)
+                    col3.metric("Total", successful_bulk + failed_bulk)
+                    
+                    st.success(f"🎵 Descarga masiva completada en: {download_path_bulk}")
+                    
+                    offer_batch_export(f"bulk_results_{datetime.now():%Y%m%d_%H%M%S}", bulk_output_files, bulk_results)
+                    
+                    if not ffmpeg_installed or use_alternative_bulk:
+                        st.info("""
+                        📝 **Nota:** Los archivos se descargaron en formato de audio original.
+                        Para convertir a MP3, instala FFmpeg y usa la descarga normal.
+                        """)
                 
-                if not ffmpeg_installed or use_alternative_bulk:
-                    st.info("""
-                    📝 **Nota:** Los archivos se descargaron en formato de audio original.
-                    Para convertir a MP3, instala FFmpeg y usa la descarga normal.
-                    """)
+                show_profile_summary(profiler)
     
     with tab4:
         st.header("📹 Descargar Videos de YouTube")
@@ -575,15 +2316,11 @@ def main():
                 placeholder="https://www.youtube.com/watch?v=dQw4w9WgXcQ",
                 key="single_video_url"
             )
-            if single_url and ('youtube.com/watch?v=' in single_url or 'youtu.be/' in single_url):
-                # Normalize URL
-                if 'youtu.be/' in single_url:
-                    video_id = single_url.split('youtu.be/')[-1].split('?')[0]
-                    normalized_url = f"https://www.youtube.com/watch?v={video_id}"
-                else:
-                    normalized_url = single_url
+            # Normalize URL (playlists and channels are also accepted)
+            normalized_url = normalize_youtube_link(single_url) if single_url else None
+            if normalized_url:
                 video_urls = [normalized_url]
-                st.success("✅ Enlace válido")
+                st.success("✅ Enlace válido" + (" (lista/canal)" if is_playlist_link(normalized_url) else ""))
         else:
             # Multiple URLs input
             multi_urls_text = st.text_area(
@@ -595,18 +2332,13 @@ def main():
             
             if multi_urls_text:
                 raw_urls = [url.strip() for url in multi_urls_text.split('\n') if url.strip()]
-                for url in raw_urls:
-                    if 'youtube.com/watch?v=' in url or 'youtu.be/' in url:
-                        if 'youtu.be/' in url:
-                            video_id = url.split('youtu.be/')[-1].split('?')[0]
-                            normalized_url = f"https://www.youtube.com/watch?v={video_id}"
-                        else:
-                            normalized_url = url
-                        video_urls.append(normalized_url)
+                video_urls = [url for url in map(normalize_youtube_link, raw_urls) if url]
                 
                 if video_urls:
                     st.success(f"✅ {len(video_urls)} enlaces válidos encontrados")
         
+        has_playlists_video = any(is_playlist_link(url) for url in video_urls)
+        
         # Show video info and quality options if URLs are provided
         if video_urls:
             # Folder selection
@@ -628,12 +2360,14 @@ def main():
                     try:
                         with st.spinner("Obteniendo información del video..."):
                             ydl_opts = {
+                                'noplaylist': True,
                                 'quiet': True,
                                 'no_warnings': True,
                             }
                             
                             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                info = ydl.extract_info(video_urls[0], download=False)
+                                # Playlists and channels use their first video as reference
+                                info = ydl.extract_info(next(iter_video_urls(video_urls[:1])), download=False)
                                 
                                 # Show video title
                                 st.subheader(f"📹 {info.get('title', 'Título no disponible')}")
@@ -792,43 +2526,59 @@ def main():
                                     with col1:
                                         subtitle_option = st.checkbox("Descargar subtítulos", key="download_subs")
                                         thumbnail_option = st.checkbox("Descargar miniatura", key="download_thumb")
+                                        merge_audio_option = False
+                                        if download_type == "🎬 Solo Video":
+                                            merge_audio_option = st.checkbox("Intentar combinar con audio", key="merge_audio")
                                     
                                     with col2:
-                                        if len(video_urls) > 1:
+                                        if len(video_urls) > 1 or has_playlists_video:
                                             max_video_downloads = st.number_input(
                                                 "Máximo de videos a descargar:",
                                                 min_value=1,
-                                                max_value=len(video_urls),
-                                                value=min(5, len(video_urls)),
+                                                max_value=None if has_playlists_video else len(video_urls),
+                                                value=5 if has_playlists_video else min(5, len(video_urls)),
                                                 key="max_video_downloads"
                                             )
                                         else:
                                             max_video_downloads = 1
                                     
                                     # Start download
-                                    download_button_text = f"⬇️ Descargar {len(video_urls[:max_video_downloads])} video(s)"
+                                    if has_playlists_video:
+                                        download_button_text = f"⬇️ Descargar hasta {max_video_downloads} video(s)"
+                                    else:
+                                        download_button_text = f"⬇️ Descargar {len(video_urls[:max_video_downloads])} video(s)"
                                     
                                     if st.button(download_button_text, key="start_video_download"):
-                                        video_progress = st.progress(0)
-                                        video_status = st.empty()
-                                        
-                                        successful_video_downloads = 0
-                                        failed_video_downloads = 0
-                                        
-                                        videos_to_download = video_urls[:max_video_downloads]
-                                        
-                                        for i, video_url in enumerate(videos_to_download):
-                                            try:
-                                                video_status.text(f"Descargando video {i+1}/{len(videos_to_download)}")
-                                                
+                                        with JobProfiler(download_video_path, st.session_state.get('profiling_mode', False), 'video') as profiler:
+                                            video_progress = st.progress(0)
+                                            video_status = st.empty()
+                                            
+                                            successful_video_downloads = 0
+                                            failed_video_downloads = 0
+                                            
+                                            video_batch_progress = BatchProgress(0 if has_playlists_video else len(video_urls[:max_video_downloads]))
+                                            video_progress_ui = ThrottledProgressUI(video_progress, video_status, video_batch_progress)
+                                            
+                                            # Merge video+audio if needed (for separate streams)
+                                            video_format = selected_format
+                                            if merge_audio_option and '+' not in selected_format:
+                                                video_format = f"{selected_format}+bestaudio"
+                                            merge_streams = '+' in video_format
+                                            
+                                            bandwidth_limiter = get_bandwidth_limiter()
+                                            disk_budget = get_disk_budget()
+                                            manifest = get_output_manifest(download_video_path)
+                                            
+                                            def submit_video(i, video_url):
                                                 # Configure yt-dlp options
                                                 ydl_opts_video = {
-                                                    'format': selected_format,
-                                                    'outtmpl': os.path.join(download_video_path, '%(title)s.%(ext)s'),
+                                                    'format': video_format,
+                                                    # watch?v=...&list=... links download only that video
+                                                    'noplaylist': True,
                                                     'quiet': True,
                                                     'no_warnings': True,
                                                 }
-                                                
+                                            
                                                 # Add subtitle options
                                                 if subtitle_option:
                                                     ydl_opts_video.update({
@@ -836,40 +2586,62 @@ def main():
                                                         'writeautomaticsub': True,
                                                         'subtitleslangs': ['es', 'en'],
                                                     })
-                                                
+                                            
                                                 # Add thumbnail option
                                                 if thumbnail_option:
                                                     ydl_opts_video['writethumbnail'] = True
-                                                
-                                                # Merge video+audio if needed (for separate streams)
-                                                if '+' in selected_format or (download_type == "🎬 Solo Video" and 
-                                                    st.checkbox("Intentar combinar con audio", key=f"merge_audio_{i}")):
-                                                    ydl_opts_video['postprocessors'] = [{
-                                                        'key': 'FFmpegVideoConvertor',
-                                                        'preferedformat': 'mp4',
-                                                    }]
-                                                
-                                                with yt_dlp.YoutubeDL(ydl_opts_video) as ydl:
-                                                    ydl.download([video_url])
+                                            
+                                                ydl_opts_video['progress_hooks'] = [video_batch_progress.hook(i), bandwidth_limiter.hook()]
+                                                if has_playlists_video:
+                                                    video_batch_progress.add_items(1)
+                                            
+                                                interactive = max_video_downloads <= SMALL_JOB_THRESHOLD
+                                                # Separate streams are fetched concurrently and muxed in one pass
+                                                if merge_streams:
+                                                    return submit_task(download_merged_video, video_url, ydl_opts_video,
+                                                                       manifest, disk_budget, interactive=interactive)
+                                                return submit_task(run_download, video_url, ydl_opts_video, manifest, None, '',
+                                                                   disk_budget, interactive=interactive)
+                                            
+                                            def report_playlist_error(link, error):
+                                                st.error(f"❌ Error leyendo la lista {link}: {str(error)}")
+                                            
+                                            # Playlists and channels are expanded page by page while the downloads run
+                                            videos_to_download = islice(iter_video_urls(video_urls, on_error=report_playlist_error), max_video_downloads)
+                                            video_progress_ui.refresh("Descargando video(s)", force=True)
+                                            
+                                            video_output_files = []
+                                            video_results = []
+                                            
+                                            for i, video_url, future in iter_streamed(videos_to_download, submit_video, on_tick=video_progress_ui.refresh):
+                                                try:
+                                                    files = future.result()
+                                                    video_output_files.extend(files)
                                                     successful_video_downloads += 1
-                                                
-                                            except Exception as e:
-                                                failed_video_downloads += 1
-                                                st.error(f"❌ Error descargando video {i+1}: {str(e)}")
+                                                    video_results.append({'youtube_link': video_url, 'download_status': "DESCARGADO",
+                                                                          'files': [os.path.basename(path) for path in files]})
+                                                except Exception as e:
+                                                    failed_video_downloads += 1
+                                                    video_results.append({'youtube_link': video_url, 'download_status': f"ERROR: {str(e)}"})
+                                                    st.error(f"❌ Error descargando video {i+1}: {str(e)}")
                                             
-                                            # Update progress
-                                            progress_video = (i + 1) / len(videos_to_download)
-                                            video_progress.progress(progress_video)
-                                        
-                                        # Show final results
-                                        video_status.text("✅ Descarga de videos completada!")
-                                        
-                                        col1, col2, col3 = st.columns(3)
-                                        col1.metric("Exitosas", successful_video_downloads)
-                                        col2.metric("Fallidas", failed_video_downloads)
-                                        col3.metric("Total", len(videos_to_download))
+                                                # Update progress
+                                                video_batch_progress.item_done(i)
+                                            video_progress_ui.refresh(force=True)
+                                            
+                                            # Show final results
+                                            video_status.text("✅ Descarga de videos completada!")
+                                            
+                                            col1, col2, col3 = st.columns(3)
+                                            col1.metric("Exitosas", successful_video_downloads)
+                                            col2.metric("Fallidas", failed_video_downloads)
+                                            col3.metric("Total", successful_video_downloads + failed_video_downloads)
+                                            
+                                            st.success(f"📹 Videos descargados en: {download_video_path}")
+                                            
+                                            offer_batch_export(f"video_results_{datetime.now():%Y%m%d_%H%M%S}", video_output_files, video_results)
                                         
-                                        st.success(f"📹 Videos descargados en: {download_video_path}")
+                                        show_profile_summary(profiler)
                     
                     except Exception as e:
                         st.error(f"❌ Error obteniendo información del video: {str(e)}")
@@ -909,6 +2681,39 @@ def main():
     
     # Instrucciones actualizadas
     with st.sidebar:
+        # Límites globales (compartidos por todas las sesiones del servidor)
+        st.header("⚙️ Límites globales")
+        bandwidth_limiter = get_bandwidth_limiter()
+        disk_budget = get_disk_budget()
+        st.number_input(
+            "Ancho de banda máximo (MB/s, 0 = sin límite):",
+            min_value=0.0,
+            value=bandwidth_limiter.rate / (1024 * 1024),
+            step=0.5,
+            key="bandwidth_limit",
+            on_change=lambda: bandwidth_limiter.set_rate(int(st.session_state["bandwidth_limit"] * 1024 * 1024))
+        )
+        st.number_input(
+            "Presupuesto de disco (GB, 0 = sin límite):",
+            min_value=0.0,
+            value=disk_budget.budget / (1024 ** 3),
+            step=1.0,
+            key="disk_budget",
+            on_change=lambda: disk_budget.set_budget(int(st.session_state["disk_budget"] * 1024 ** 3))
+        )
+        if disk_budget.budget:
+            st.write(f"Usado: {format_bytes(disk_budget.used)} de {format_bytes(disk_budget.budget)}")
+        st.caption("Se aplican a todas las descargas de todos los usuarios")
+        
+        # Perfilado opcional de los trabajos de esta sesión
+        st.header("🔬 Diagnóstico")
+        st.checkbox(
+            "Perfilar trabajos (CPU y memoria)",
+            value=False,
+            key="profiling_mode",
+            help="Guarda un perfil de muestreo de CPU y de asignaciones de memoria en la carpeta 'profiles' del destino"
+        )
+        
         st.header("📋 Instrucciones")
         st.write("""
         ## 🔍 Buscar Enlaces:
@@ -921,6 +2726,8 @@ def main():
         
         3. **Descargas:** Cada 5% del progreso podrás descargar JSON y TXT
         
+        4. **Sincronización:** Sube también los resultados anteriores y solo se buscarán las canciones nuevas
+        
         ## ⬇️ Descargar MP3:
         1. **Archivo JSON:** Usa un JSON generado con enlaces de YouTube
         
@@ -934,6 +2741,8 @@ def main():
         2. **Formatos aceptados:**
            - `https://www.youtube.com/watch?v=...`
            - `https://youtu.be/...`
+           - `https://www.youtube.com/playlist?list=...`
+           - `https://www.youtube.com/@canal`
         
         3. **Opciones:** Elige calidad y formato de nombres
         